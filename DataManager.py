@@ -1,6 +1,28 @@
 from LockManager import LockManager
 from LockManager import Lock
+from LockManager import SiteLockManager
+from LockManager import SITE_LOCK
+from LockManager import combineModes
+from WaitsForGraph import WaitsForGraph
+from Layout import Layout
+from EventSink import EventSink
 from collections import defaultdict
+from collections.abc import Mapping
+from bisect import bisect_left
+
+
+def pruneHistory(history, horizon):
+    '''
+    history: list of (timestamp, ...) entries sorted by timestamp
+    horizon: start time of the oldest active read-only transaction. None if there is no such transaction
+
+    Removes the entries that no read-only transaction can see. The latest entry before the horizon is kept
+    since it is the state seen by the oldest transaction. Only the last entry is kept when horizon is None
+    '''
+
+    keepFrom = len(history) - 1 if horizon is None else bisect_left(history, (horizon,)) - 1
+    if keepFrom > 0:
+        del history[:keepFrom]
 
 class Variable:
     def __init__(self, varId, val, isReplicated):
@@ -12,6 +34,8 @@ class Variable:
         isReadable: Indicates if the variable can be read. False in case the site went down 
                     and the variable is replicated
         isReplicated: Indicates if the variable is replicated
+        versions: list of committed states of the variable as (timestamp, value, isReadable), oldest first.
+                  Used by read-only transactions to read the state at the time they began
         '''
 
         self.varId = varId
@@ -20,41 +44,215 @@ class Variable:
         self.lastWrite = 0
         self.isReadable = True
         self.isReplicated = isReplicated
+        self.versions = [(-1, val, True)]
 
     def __repr__(self):
         return "{}".format( self.value)
 
+    def addVersion(self, ts, horizon):
+        '''
+        ts: time at which the value or readability of the variable changed
+        horizon: start time of the oldest active read-only transaction, None if there is none
+
+        Records the current state of the variable as a version and removes the versions nobody can read anymore
+        '''
+        self.versions.append((ts, self.value, self.isReadable))
+        pruneHistory(self.versions, horizon)
+
+    def getVersion(self, ts):
+        '''
+        ts: start time of a read-only transaction
+
+        Returns the (timestamp, value, isReadable) version of the variable committed before ts
+        '''
+        return self.versions[bisect_left(self.versions, (ts,)) - 1]
+
+class LazyTable(Mapping):
+    def __init__(self, positions, factory):
+        '''
+        positions: Dictionary with the names of the entries as keys and their position at the site as values
+        factory: function of the name and position creating an entry
+        loaded: Dictionary of the entries created so far
+
+        Read only dictionary whose entries are created when they are first looked up. Lookups of names and
+        iteration over the names do not create entries
+        '''
+
+        self.positions = positions
+        self.factory = factory
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        entry = self.loaded.get(name)
+        if entry is None:
+            entry = self.loaded[name] = self.factory(name, self.positions[name])
+        return entry
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self):
+        return repr(self.loaded)
+
 class DataManager:
-    def __init__(self,siteId):
+    def __init__(self,siteId, waitsForGraph=None, changedVars=None, layout=None, sink=None, stats=None, wal=None, prevention=None, isQuorum=False, trace=None,
+                 escalationThreshold=None):
         '''
         siteId: Site id
+        waitsForGraph: WaitsForGraph shared by the sites, updated as locks on the site are requested, granted and released
+        changedVars: set shared with the transaction manager to which the names of the variables whose locks,
+                     readability or availability changed are added. Used to wake up the operations waiting on them
+        layout: Layout deciding the variables stored at the site. Uses the default layout if None
+        sink: EventSink to which the lock warnings are emitted
+        stats: Stats counting lock grants and waits. Nothing is counted if None
+        wal: WriteAheadLog to which committed writes, failures and recoveries are appended. Nothing is logged if None
+        prevention: DeadlockPrevention deciding if a transaction may wait for a lock. Every request waits if None
+        isQuorum: Indicates if the variables are replicated with read and write quorums. The replicated variables
+                  then stay readable after a recovery, since a read compares the versions of a quorum of replicas
+        trace: TraceRecorder to which the lock grants and waits are recorded. Nothing is recorded if None
+        escalationThreshold: number of variable locks of a transaction at the site above which they are replaced by
+                             a lock on the whole site. With a threshold a transaction also needs an intention lock on
+                             the site before locking a variable. Only variables are locked if None
+        siteLock: SiteLockManager of the site, None without an escalation threshold
+        resumedRequests: Dictionary with transaction id as key and set of the variables whose lock requests waited
+                         for the site lock as value. The next request of the variable is queued like a new one
         isUp: Indicates if the site is up or down
-        variableList: dictionary containing the name of variable as keys and value of variable as values
-        lockTable: Dictionary containing variable name as key and corresponsing lock manager as value
+        variableList: LazyTable containing the name of variable as keys and value of variable as values.
+                      A Variable is created when it is first used, from the image or with its initial value
+        lockTable: LazyTable containing variable name as key and corresponsing lock manager as value.
+                   A LockManager is created when the variable is first locked
         upSince: time since when the site is up
+        varOrder: Dictionary containing variable name as key and its position in the lock table as value
+        layout: Layout of the sites and variables
+        image: SiteImage of the checkpoint the site was restored from. The variables not used since the restart are
+               read from it. None if the site was not restored from a checkpoint
+        unreadableSince: time of the first recovery since the start. The replicated variables created after it are
+                         unreadable since then, as if they had been there at the recovery
+        transLocks: Dictionary containing transaction id as key and set of variables on which the transaction
+                    holds or requests a lock as value
+        transWrites: Dictionary containing transaction id as key and set of variables for which the transaction
+                     has written a temporary value as value
+        unresolvedVars: set of variables whose locks were released by a commit that stopped at a pending request
+                        and which have to be resolved with the next lock table resolution
+        upHistory: list of (timestamp, isUp) entries recording when the site failed and recovered, oldest first
+        undumpedVars: set of variables whose value was committed since they were last dumped
+        caughtUpSince: Dictionary with the name of a replicated variable not created yet as key and the time it was
+                       made readable by a catch up after the last recovery as value
+        versionedVars: set of the loaded variables holding more than one version. Their old versions are removed
+                       once the read-only transactions that could see them ended
 
         The variablesList is initialized in this method
         '''
         self.siteId = siteId
         self.isUp = True
-        self.variableList = {}
-        self.lockTable = {}
         self.upSince = 0
+        self.transLocks = defaultdict(set)
+        self.transWrites = defaultdict(set)
+        self.unresolvedVars = set()
+        self.upHistory = [(-1, True)]
+        self.undumpedVars = set()
+        self.versionedVars = set()
+        self.caughtUpSince = {}
+        self.waitsForGraph = waitsForGraph if waitsForGraph else WaitsForGraph()
+        self.changedVars = changedVars if changedVars is not None else set()
+        self.sink = sink if sink else EventSink()
+        self.stats = stats
+        self.wal = wal
+        self.prevention = prevention
+        self.isQuorum = isQuorum
+        self.trace = trace
+        self.escalationThreshold = escalationThreshold
+        self.siteLock = SiteLockManager() if escalationThreshold else None
+        self.resumedRequests = defaultdict(set)
+        self.layout = layout if layout else Layout()
+        self.image = None
+        self.unreadableSince = None
+
+        # The variables and lock managers are only created when they are used, so only the positions are built here
+        self.varOrder = {'x'+str(i): pos for pos, i in enumerate(self.layout.getSiteVariables(self.siteId))}
+        self.variableList = LazyTable(self.varOrder, self.loadVariable)
+        self.lockTable = LazyTable(self.varOrder, lambda var, pos: LockManager(var))
 
-        for i in range(1,21):
-            var = 'x'+str(i)
-            if i&1==0:
+        # print("site {}: {}".format(siteId, self.variableList))
 
-                # These are even values and are present in all sites and hence are replicated
-                self.variableList[var] = Variable(var,10*i, True)
-                self.lockTable[var] = LockManager(var)
-            elif i%10 + 1 == self.siteId:
+    def loadVariable(self, varId, pos):
+        '''
+        varId: name of the variable
+        pos: position of the variable at the site
 
-                # These values are not replicated since they are present in particular sites
-                self.variableList[var] = Variable(var,10*i, False)
-                self.lockTable[var] = LockManager(var)
+        Creates the variable with its committed state, taken from the image if the site was restored from one
+        '''
 
-        # print("site {}: {}".format(siteId, self.variableList))
+        # Replicated variables are present at several sites, the others only at this site
+        i = int(varId[1:])
+        var = Variable(varId, 10*i, self.layout.isReplicated(i))
+        if self.image:
+            var.value, var.lastWrite, var.isReadable = self.image.read(pos, i)
+            var.versions = [(var.lastWrite, var.value, var.isReadable)]
+
+        if var.isReplicated and self.unreadableSince is not None:
+            var.isReadable = False
+            var.versions.append((self.unreadableSince, var.value, False))
+            self.versionedVars.add(varId)
+            if varId in self.caughtUpSince:
+                var.isReadable = True
+                var.versions.append((self.caughtUpSince.pop(varId), var.value, True))
+
+        return var
+
+    def addVersion(self, var, ts, horizon):
+        '''
+        var: Variable whose value or readability changed
+        ts: time of the change
+        horizon: start time of the oldest active read-only transaction, None if there is none
+
+        Records the state of the variable as a version and remembers the variable if it keeps old versions
+        '''
+
+        var.addVersion(ts, horizon)
+        if len(var.versions) > 1:
+            self.versionedVars.add(var.varId)
+
+    def pruneVersions(self, horizon):
+        '''
+        horizon: start time of the oldest active read-only transaction, None if there is none
+
+        Called when the horizon moved because a read-only transaction ended. Removes the versions and the up
+        history entries that no active read-only transaction can see
+        '''
+
+        pruneHistory(self.upHistory, horizon)
+        for varId in list(self.versionedVars):
+            versions = self.variableList.loaded[varId].versions
+            pruneHistory(versions, horizon)
+            if len(versions) == 1:
+                self.versionedVars.discard(varId)
+
+    def getCommittedState(self, varId):
+        '''
+        varId: name of the variable
+
+        Returns the (value, lastWrite, isReadable) of the variable without creating it
+        '''
+
+        var = self.variableList.loaded.get(varId)
+        if var is not None:
+            return (var.value, var.lastWrite, var.isReadable)
+
+        i = int(varId[1:])
+        if self.image:
+            value, lastWrite, isReadable = self.image.read(self.varOrder[varId], i)
+        else:
+            value, lastWrite, isReadable = (10*i, 0, True)
+        if self.unreadableSince is not None and self.layout.isReplicated(i):
+            isReadable = varId in self.caughtUpSince
+        return (value, lastWrite, isReadable)
 
     def getSiteId(self):
         return self.siteId
@@ -63,43 +261,260 @@ class DataManager:
         # Returns boolean value indicating if the variable is present in the site
         return (var in self.variableList.keys())
 
-    def dump(self):
+    def dump(self, varList=None, changedOnly=False):
         '''
-        The method iterates the variable list and prints their name and values
+        varList: names of the variables to be dumped, all the variables of the site if None
+        changedOnly: Indicates if only the variables committed since they were last dumped are dumped
+
+        Returns a dictionary with the name of the variables as keys and their committed values as values, in the
+        order of the variables at the site. The dumped variables are no longer changed until their next commit
         '''
 
-        printString = 'Site ' + str(self.siteId) + ' - '
-        
-        for var in self.variableList.keys():
-            printString += var + ': ' + str(self.variableList[var]) + ' '
+        if changedOnly:
+            names = self.undumpedVars if varList is None else self.undumpedVars.intersection(varList)
+            names = sorted(names, key=self.varOrder.get)
+        else:
+            names = self.variableList.keys() if varList is None else [var for var in varList if var in self.varOrder]
+
+        values = {}
+        for var in names:
+            values[var] = self.getCommittedState(var)[0]
+
+        if varList is None:
+            self.undumpedVars.clear()
+        else:
+            self.undumpedVars.difference_update(values)
+
+        return values
+
+    def indexLock(self, trans_id, var, isQueued=False):
+        '''
+        trans_id: transaction id
+        var: name of the variable
+        isQueued: Indicates if the request was queued instead of granted
+
+        Records that the transaction holds or has requested a lock on the variable so that commit and abort
+        only need to visit the variables used by the transaction
+        '''
+        self.transLocks[trans_id].add(var)
+        self.lockChanged(self.lockTable[var])
+        if self.stats:
+            self.stats.count('lock waits' if isQueued else 'lock grants')
+        if self.trace:
+            self.trace.lock(self.siteId, trans_id, var, isQueued)
+        if self.siteLock and not isQueued and len(self.transLocks[trans_id]) >= self.escalationThreshold:
+            self.escalate(trans_id)
+
+    def indexWrite(self, trans_id, var, val):
+        '''
+        trans_id: transaction id
+        var: name of the variable
+        val: temporary value written by the transaction
+
+        Stores the temporary value of the variable and records it in the write index of the transaction
+        '''
+        self.variableList[var].tempVal[trans_id] = val
+        self.transWrites[trans_id].add(var)
+
+    def promoteLock(self, lockManager, trans_id):
+        '''
+        lockManager: lock manager of the variable
+        trans_id: transaction id
+
+        Promotes the read lock of the transaction to a write lock and emits a warning if it cannot be promoted
+        '''
+        message = lockManager.promoteLock(trans_id)
+        if message:
+            self.sink.emit('lockWarning', site=self.siteId, var=lockManager.var, message=message)
+        elif self.stats:
+            self.stats.count('lock promotions')
+
+    def queueRequest(self, lockManager, lockType, trans_id):
+        '''
+        lockManager: lock manager of the variable
+        lockType: R or W
+        trans_id: transaction id
+
+        Adds the request to the queue of the lock manager, unless the deadlock prevention policy decides that the
+        transaction dies instead of waiting
+        '''
+        if self.prevention and not self.prevention.mayWait(trans_id, lockManager.blockers(lockType, trans_id)):
+            return
+        lockManager.pendingRequests.append(lockType, trans_id)
+        self.indexLock(trans_id, lockManager.var, True)
+
+    def lockSite(self, trans_id, var, mode):
+        '''
+        trans_id: transaction id
+        var: name of the variable the transaction is about to lock
+        mode: IS before a read lock, IX before a write lock
+
+        Gives the transaction the intention mode on the site. If another transaction holds an incompatible mode,
+        the request waits for the site lock, unless the deadlock prevention policy decides that the transaction
+        dies instead. Returns true if the transaction holds the mode
+        '''
+
+        if self.siteLock.acquire(mode, trans_id):
+            return True
+
+        if not self.siteLock.pendingRequests.hasTransaction(trans_id):
+            if self.prevention and not self.prevention.mayWait(trans_id, self.siteLock.blockers(mode, trans_id)):
+                return False
+            self.siteLock.pendingRequests.append(mode, trans_id)
+            self.lockChanged(self.siteLock)
+            if self.stats:
+                self.stats.count('site lock waits')
+            if self.trace:
+                self.trace.lock(self.siteId, trans_id, SITE_LOCK, True)
+        self.siteLock.waitingVars.setdefault(trans_id, set()).add(var)
+        return False
+
+    def isResumed(self, trans_id, var):
+        '''
+        trans_id: transaction id
+        var: name of the variable
+
+        Returns true if the lock request of the variable waited for the site lock, which the transaction now holds.
+        The request is then queued on the variable like a new one
+        '''
+
+        resumed = self.resumedRequests.get(trans_id)
+        if resumed and var in resumed:
+            resumed.discard(var)
+            return True
+        return False
+
+    def resolveSiteLock(self):
+        '''
+        Gives the waiting transactions their modes on the site in the order they asked, as long as they are
+        compatible with the modes held. The variables the granted transactions wait for are marked changed so that
+        their operations are tried again
+        '''
+
+        queue = self.siteLock.pendingRequests
+        while len(queue):
+            req = queue.head()
+            wanted = combineModes(self.siteLock.modes.get(req.trans_id), req.lockType)
+            if self.siteLock.conflicts(wanted, req.trans_id):
+                break
+            self.siteLock.modes[req.trans_id] = wanted
+            queue.popHead()
+            for var in self.siteLock.waitingVars.pop(req.trans_id, ()):
+                self.changedVars.add(var)
+                self.resumedRequests[req.trans_id].add(var)
+        self.lockChanged(self.siteLock)
+
+    def releaseSite(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Releases the site lock of the transaction and its waiting request, then resolves the site lock
+        '''
+
+        self.resumedRequests.pop(trans_id, None)
+        if trans_id in self.siteLock.modes or self.siteLock.pendingRequests.hasTransaction(trans_id):
+            self.siteLock.removeLocks(trans_id)
+            self.resolveSiteLock()
+
+    def escalate(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Replaces the variable locks of the transaction by S on the site if it only read at the site, by X otherwise.
+        Nothing happens if another transaction holds an incompatible mode. The variables still requested by the
+        transaction keep their requests
+        '''
+
+        held = self.siteLock.modes.get(trans_id)
+        mode = 'S' if held == 'IS' else 'X'
+        if self.siteLock.conflicts(mode, trans_id):
+            return
+
+        self.siteLock.modes[trans_id] = mode
+        self.lockChanged(self.siteLock)
+        if self.stats:
+            self.stats.count('lock escalations')
+        if self.trace:
+            self.trace.lock(self.siteId, trans_id, SITE_LOCK, False)
+
+        released = []
+        for var in self.transLocks.pop(trans_id, set()):
+            lockManager = self.lockTable[var]
+            if lockManager.pendingRequests.hasTransaction(trans_id):
+                self.transLocks[trans_id].add(var)
+                continue
+            self.lockChanged(lockManager)
+            lockManager.removeLocks(trans_id)
+            released.append(var)
+        self.resolveLockTable(released)
+
+    def isWriteLocked(self, var):
+        '''
+        var: name of the variable
+
+        Returns true if a transaction holds a write lock on the variable, either on the variable itself or through
+        X on the site after writing it
+        '''
+
+        lockManager = self.lockTable.loaded.get(var)
+        if lockManager and lockManager.currentLock and lockManager.currentLock.lockType == 'W':
+            return True
+        if not self.siteLock:
+            return False
+        # A variable that was not created yet has no tentative value
+        variable = self.variableList.loaded.get(var)
+        return variable is not None and self.siteLock.exclusiveHolder() in variable.tempVal
+
+    def lockChanged(self, lockManager):
+        '''
+        lockManager: lock manager whose current lock or pending requests changed
 
-        print(printString)
+        Notifies the waits-for graph and the transaction manager about the change
+        '''
+        self.waitsForGraph.markChanged(self.siteId, lockManager)
+        self.changedVars.add(lockManager.var)
 
     
     ####### READ - WRITE OPERATIONS #############
      
 
-    def readSnapshot(self):
+    def readVersion(self, var, ts):
         '''
-        Returns the snapshot of the variables available on the site
-        Returns a dictionary with variable name as keys and variable values as value.
+        var: variable name
+        ts: start time of the read-only transaction
+
+        Returns a tuple (found, value). found indicates if the site was up at time ts and the variable could be read
+        at that time, in which case value is the value of the variable committed before ts
         '''
 
-        snapshotList = {}
+        if var not in self.variableList.keys():
+            return (False, None)
 
-        for varId in self.variableList.keys():
-            var = self.variableList[varId]
+        # Check if the site was up when the transaction began
+        if not self.upHistory[bisect_left(self.upHistory, (ts,)) - 1][1]:
+            return (False, None)
 
-            # Check if the variable is replicated
-            if var.isReplicated:
+        tempVar = self.variableList[var]
+        version = tempVar.getVersion(ts)
 
-                # If var is replicated, then add the variable only if it is readable
-                if var.isReadable:
-                    snapshotList[var.varId] = var.value
-            else:
-                snapshotList[var.varId] = var.value
+        # If var is replicated, then it can be read only if it was readable
+        if tempVar.isReplicated and not version[2]:
+            return (False, None)
 
-        return snapshotList
+        return (True, version[1])
+
+    def getVersion(self, var, ts):
+        '''
+        var: variable name
+        ts: start time of the read-only transaction
+
+        Returns the (timestamp, value, isReadable) version of the variable committed before ts, None if the site
+        does not hold the variable. Used by quorum reads, which compare the timestamps of the replicas
+        '''
+
+        if var not in self.variableList.keys():
+            return None
+        return self.variableList[var].getVersion(ts)
 
     def read(self, trans_id, var, isNew):
         '''
@@ -118,6 +533,14 @@ class DataManager:
 
         # check if the variable is readable
         if tempVar.isReadable:
+            if self.siteLock:
+                # S or X on the site stands for the read lock, otherwise the transaction needs IS on the site
+                if self.siteLock.covers(trans_id, 'R'):
+                    return tempVar.tempVal.get(trans_id, tempVar.value)
+                if not self.lockSite(trans_id, var, 'IS'):
+                    return None
+                isNew = isNew or self.isResumed(trans_id, var)
+
             tempLockManager = self.lockTable[var]
             tempLock = tempLockManager.currentLock
 
@@ -132,11 +555,12 @@ class DataManager:
                     # Check if there is any write lock in pending which might conflict with this write lock
                     elif not tempLockManager.hasQueuedWrite():
                         tempLock.transactions.append(trans_id)
+                        self.indexLock(trans_id, var)
                         return tempVar.value
                     # If there is a conflict, add the current request to the queue
                     else:
                         if isNew:
-                            tempLockManager.pendingRequests.append(Lock(var, "R", [trans_id]))
+                            self.queueRequest(tempLockManager, 'R', trans_id)
                         return None
                 # current lock is a write lock. Check if the lock is held by current transaction
                 elif trans_id in tempLock.transactions:
@@ -147,10 +571,11 @@ class DataManager:
                 # If write lock is not held by current transaction, add the read request to the queue
                 else:
                     if isNew:
-                        tempLockManager.pendingRequests.append(Lock(var, "R", [trans_id]))
+                        self.queueRequest(tempLockManager, 'R', trans_id)
                     return None
             else:
                 tempLockManager.currentLock = Lock(var, "R", [trans_id])
+                self.indexLock(trans_id, var)
                 return tempVar.value
         else:
             return None
@@ -173,6 +598,11 @@ class DataManager:
         else:
             return None
 
+        # X on the site stands for the write lock
+        if self.siteLock and self.siteLock.covers(trans_id, 'W'):
+            self.indexWrite(trans_id, var, val)
+            return None
+
         tempLockManager = self.lockTable[var]
         tempLock = tempLockManager.currentLock
 
@@ -190,8 +620,9 @@ class DataManager:
                         else:
                             # promote the lock to write and write the variable with the given value in tempVar
                             # The variable will be written when the transaction commits
-                            tempLockManager.promoteLock(trans_id)
-                            tempVar.tempVal[trans_id] = val
+                            self.promoteLock(tempLockManager, trans_id)
+                            self.lockChanged(tempLockManager)
+                            self.indexWrite(trans_id, var, val)
                             return None
                     else:
                         # print("Other transactions holding R locks")
@@ -202,7 +633,7 @@ class DataManager:
             elif tempLock.lockType == 'W':
                 # If current lock is W then check if the current transaction hold lock and perform approporiate actions
                 if trans_id in tempLock.transactions:
-                    tempVar.tempVal[trans_id] = val
+                    self.indexWrite(trans_id, var, val)
                     return None
                 else:
                     # print("Other transaction having W lock")
@@ -210,7 +641,21 @@ class DataManager:
 
         # If not lock is held on the variable, give the transaction the write lock
         tempLockManager.currentLock = Lock(var, "W", [trans_id])
-        tempVar.tempVal[trans_id] = val
+        self.indexLock(trans_id, var)
+        self.indexWrite(trans_id, var, val)
+
+
+    def writeMany(self, trans_id, writes):
+        '''
+        trans_id: transaction id
+        writes: list of (variable, value) pairs written by a batch, in order
+
+        Writes the variables of the list held by the site
+        '''
+
+        for var, val in writes:
+            if var in self.variableList:
+                self.write(trans_id, var, val)
 
 
 ########## LOCK ASSIGNMENT OPERATIONS #############
@@ -230,6 +675,14 @@ class DataManager:
         else:
             return False
 
+        if self.siteLock:
+            # X on the site stands for the write lock, otherwise the transaction needs IX on the site
+            if self.siteLock.covers(trans_id, 'W'):
+                return True
+            if not self.lockSite(trans_id, var, 'IX'):
+                return False
+            isNew = isNew or self.isResumed(trans_id, var)
+
         tempLockManager = self.lockTable[var]
         tempLock = tempLockManager.currentLock
 
@@ -245,21 +698,21 @@ class DataManager:
                         # that conflicts the current lock
                         if tempLockManager.hasQueuedWrite(trans_id):
                             if isNew:
-                                tempLockManager.pendingRequests.append(Lock(var, 'W', [trans_id]))
+                                self.queueRequest(tempLockManager, 'W', trans_id)
                             # print("Cannot promote to W-lock, other process is waiting")
                             return False
                         else:
                             return True
                     else:
                         if isNew:
-                            tempLockManager.pendingRequests.append(Lock(var, 'W', [trans_id]))
+                            self.queueRequest(tempLockManager, 'W', trans_id)
                         # print("Other transactions holding R locks")
                         return False
                 else:
                     # Other transactions hold the read lock and current transaction does not hold the read lock
                     # print("transactions does not hold R locks")
                     if isNew:
-                        tempLockManager.pendingRequests.append(Lock(var, 'W', [trans_id]))
+                        self.queueRequest(tempLockManager, 'W', trans_id)
                     return False
 
             # check if current lock if of type write
@@ -269,41 +722,63 @@ class DataManager:
                 else:
                     # print("Other transaction having W lock")
                     if isNew:
-                        tempLockManager.pendingRequests.append(Lock(var, 'W', [trans_id]))
+                        self.queueRequest(tempLockManager, 'W', trans_id)
                     return False
         return True
 
-    def resolveLockTable(self):
+    def getWriteLocks(self, trans_id, varList, isNew):
+        '''
+        trans_id: transaction id
+        varList: names of the variables written by a batch
+
+        Requests the write locks of the variables of the list held by the site in one call.
+        Returns the list of (variable, lock given) pairs of those variables
+        '''
+
+        return [(var, self.getWriteLock(trans_id, var, isNew)) for var in varList if var in self.variableList]
+
+    def resolveLockTable(self, varList=None):
         '''
+        varList: names of the variables whose lock managers have to be checked. All the lock managers created so far
+                 are checked if None
+
         The method iterates through the lock table to find if there is any pending request that can now be fulfilled.
         If it finds such a request, it assigns corresponding lock to the transaction
         '''
 
-        for lockManager in self.lockTable.values():
+        if varList is None:
+            varList = list(self.lockTable.loaded.keys())
+        elif self.unresolvedVars:
+            varList = self.unresolvedVars.union(varList)
+            self.unresolvedVars = set()
+
+        for var in varList:
+            lockManager = self.lockTable[var]
             if len(lockManager.pendingRequests):
+                self.lockChanged(lockManager)
                 if not lockManager.currentLock:
-                    lock = lockManager.pendingRequests.pop(0)
-                    lockManager.currentLock = lock
-
-                removeList = []
+                    req = lockManager.pendingRequests.popHead()
+                    lockManager.currentLock = Lock(var, req.lockType, [req.trans_id])
+                    if self.stats:
+                        self.stats.count('lock grants')
 
                 # Check if the currently held lock is of type read
+                # The granted requests are always at the head of the queue, so they are popped one by one
                 if lockManager.currentLock.lockType == 'R':
-                    for pending in lockManager.pendingRequests:
+                    while len(lockManager.pendingRequests):
+                        pending = lockManager.pendingRequests.head()
                         if pending.lockType == 'W':
                             # If the request lock is write and the requesting transaction is the only transaction holding the read lock, promote the lock
-                            if len(lockManager.currentLock.transactions)==1 and (pending.transactions[0] == lockManager.currentLock.transactions[0]):
-                                lockManager.promoteLock(pending.transactions[0])
-                                removeList.append(pending)
+                            if len(lockManager.currentLock.transactions)==1 and (pending.trans_id == lockManager.currentLock.transactions[0]):
+                                self.promoteLock(lockManager, pending.trans_id)
                             else:
                                 break
                         else:
                             # If the requesting lock is also read assign the lock so that the lock will be shared read lock
-                            lockManager.currentLock.transactions.append(pending.transactions[0])
-                            removeList.append(pending)
-
-                    for pending in removeList:
-                        lockManager.pendingRequests.remove(pending)
+                            lockManager.currentLock.transactions.append(pending.trans_id)
+                            if self.stats:
+                                self.stats.count('lock grants')
+                        lockManager.pendingRequests.popHead()
 
 
 ######### ABORT AND COMMIT OPERATIONS #############
@@ -313,15 +788,21 @@ class DataManager:
         '''
         trans_id: transaction id
         
-        The method iterates the lock table and checks in lock manager of each variable if the current transaction helds
-        or requests locks.
-        If such a lock is found, it is removed
+        The method looks up the variables locked or requested by the transaction in the lock index and removes
+        the locks and pending requests of the transaction from their lock managers
 
-        It also checks if the transaction wrote any temp value in the tempVal list and removes it if found
+        It also removes the temp values written by the transaction using the write index
         '''
 
-        for lockManager in self.lockTable.values():
+        if self.siteLock:
+            self.releaseSite(trans_id)
+
+        lockedVars = self.transLocks.pop(trans_id, set())
+
+        for var in lockedVars:
+            lockManager = self.lockTable[var]
             tempLock = lockManager.currentLock
+            self.lockChanged(lockManager)
 
             # Check if current transaction holds a lock and remove it if yes
             if tempLock and trans_id in tempLock.transactions:
@@ -329,159 +810,239 @@ class DataManager:
                 if len(tempLock.transactions) == 0:
                     lockManager.currentLock = None
 
-            removeList = []
-
-            # Iterate the pending requests and check if current transaction has any pending requests 
-            for pending in lockManager.pendingRequests:
-                if trans_id in pending.transactions:
-                    removeList.append(pending)
-                
-            for pending in removeList:
-                lockManager.pendingRequests.remove(pending)
+            # Remove the pending requests of the current transaction
+            lockManager.pendingRequests.removeTransaction(trans_id)
 
         # Remove any tempVal of the variable written by the transaction
-        for var in self.variableList.values():
-            if trans_id in var.tempVal.keys():
-                var.tempVal.pop(trans_id)
+        for var in self.transWrites.pop(trans_id, set()):
+            self.variableList[var].tempVal.pop(trans_id, None)
 
-        self.resolveLockTable()
+        self.resolveLockTable(lockedVars)
     
-    def commit(self, trans_id, ts):
+    def commit(self, trans_id, ts, horizon=None):
         '''
         trans_id: transaction id
         ts: time when transaction commits
+        horizon: start time of the oldest active read-only transaction, None if there is none
 
         The method checks the locks held by the transaction and release them. Also it checks if the transaction has 
         any pending lock request
         Lastly it commits the temporary values written by the transaction to the value of variable
+        and records the committed values as new versions
         '''
 
-        for lockManager in self.lockTable.values():
-            if not lockManager.removeLocks(trans_id):
+        if self.siteLock:
+            self.releaseSite(trans_id)
+
+        # Visit the variables in lock table order so that a pending request stops the release at the same point
+        lockedVars = sorted(self.transLocks.get(trans_id, ()), key=self.varOrder.get)
+
+        for i in range(len(lockedVars)):
+            self.lockChanged(self.lockTable[lockedVars[i]])
+            if not self.lockTable[lockedVars[i]].removeLocks(trans_id):
+                self.sink.emit('unresolvedLocks', trans_id=trans_id, site=self.siteId, var=lockedVars[i])
+                # The remaining variables stay in the index since the transaction still holds or requests them
+                # The released variables are resolved along with the next commit or abort on the site
+                self.transLocks[trans_id] = set(lockedVars[i:])
+                self.unresolvedVars.update(lockedVars[:i+1])
                 return None
-              
+
+        self.transLocks.pop(trans_id, None)
            
         # Write the tempVal written by transaction to the variable value.
         # Make the variable readable which may have been rendered false at site failure
         # Change the lastWrite time of the variable to current time
-        for var in self.variableList.values():
+        for varId in self.transWrites.pop(trans_id, set()):
+            var = self.variableList[varId]
             if trans_id in var.tempVal.keys():
-                var.value = var.tempVal[trans_id]
+                var.value = var.tempVal.pop(trans_id)
                 var.isReadable = True
                 var.lastWrite = ts
+                self.addVersion(var, ts, horizon)
+                self.changedVars.add(varId)
+                self.undumpedVars.add(varId)
+                if self.wal:
+                    self.wal.append({'op': 'W', 'var': varId, 'value': var.value, 'ts': ts})
 
         # print('lock table: ',self.lockTable)
         
-        self.resolveLockTable()
+        self.resolveLockTable(lockedVars)
 
 
 ############# FAIL RECOVER OPERATIONS ############
 
-    def fail(self):
+    def fail(self, ts=0, horizon=None):
         '''
+        ts: timestamp when the site fails
+        horizon: start time of the oldest active read-only transaction, None if there is none
+
         It changes the isUp variable to indicate that the site is down
         Removes any current locks held on the variable
         Also removes pending request information on the variable
         '''
 
         self.isUp = False
-        for manager in self.lockTable.values():
+        self.upHistory.append((ts, False))
+        if self.wal:
+            self.wal.append({'op': 'fail', 'ts': ts})
+        pruneHistory(self.upHistory, horizon)
+        # Only the lock managers created so far can hold locks
+        for manager in self.lockTable.loaded.values():
+            if manager.currentLock or manager.pendingRequests:
+                self.lockChanged(manager)
             manager.currentLock = None
-            manager.pendingRequests = []
-
-    def recover(self, ts):
+            manager.pendingRequests.clear()
+        if self.siteLock:
+            self.siteLock.modes.clear()
+            self.siteLock.pendingRequests.clear()
+            self.siteLock.waitingVars.clear()
+            self.resumedRequests.clear()
+            self.lockChanged(self.siteLock)
+        self.transLocks.clear()
+        self.unresolvedVars.clear()
+        self.changedVars.update(self.variableList.keys())
+
+    def recover(self, ts, horizon=None):
         '''
         ts: timestamp when the site recovers
+        horizon: start time of the oldest active read-only transaction, None if there is none
 
         It changes the isUp variable to indicate that the site is now available
-        Changes readable status of replicated variables to false
+        Changes readable status of replicated variables to false, unless quorums are used
         Updates the upSince time to indicate the time from when the site has been active
         '''
 
         self.isUp = True
         self.upSince = ts
+        self.upHistory.append((ts, True))
+        if self.wal:
+            self.wal.append({'op': 'recover', 'ts': ts})
+        pruneHistory(self.upHistory, horizon)
         
-        for var in self.variableList.values():
-            if var.isReplicated:
-                var.isReadable = False
+        if not self.isQuorum:
+            # The variables caught up since the last recovery are created so that they keep their readable version
+            for varId in list(self.caughtUpSince):
+                self.variableList[varId]
+            for var in self.variableList.loaded.values():
+                if var.isReplicated:
+                    var.isReadable = False
+                    self.addVersion(var, ts, horizon)
+            if self.unreadableSince is None:
+                self.unreadableSince = ts
 
-        
-########## DEADLOCK DETECTION ###############
-    
+        self.changedVars.update(self.variableList.keys())
 
-    def generateWaitsForGraph(self):
+
+    def catchUp(self, varId, value, lastWrite, ts, horizon=None):
         '''
-        The method uses 2 helper functions defined below and return as graph.
-        The graph represents the transactions that conflict with one another.
+        varId: name of the replicated variable
+        value: value committed at an up replica
+        lastWrite: time the value was committed at the replica
+        ts: time of the catch up
+        horizon: start time of the oldest active read-only transaction, None if there is none
+
+        Sets the variable to the value committed at the replica and makes it readable after a recovery. The variable
+        is only dumped as changed if the replica committed after it
         '''
-        
-        def currentConflicts(currentLock, queuedLock):
-            '''
-            currentLock: lock currently held 
-            queuedLock: pending lock request in the queue
-
-            The method returns a bool value indicating if the current lock conflicts with the pending request
-            '''
-
-            if currentLock.lockType == 'R':
-                # If queued lock is R the n it does not conflict
-                # If queued lock is W but is requested by same transaction, and it is the only transaction holding R lock, it does not conflict 
-                if queuedLock.lockType == 'R' or (len(currentLock.transactions) == 1 and queuedLock.transactions[0] == currentLock.transactions[0]):
-                    return False
 
-                return True
+        var = self.variableList[varId]
+        if lastWrite > var.lastWrite:
+            self.undumpedVars.add(varId)
+        var.value = value
+        var.lastWrite = lastWrite
+        var.isReadable = True
+        self.addVersion(var, ts, horizon)
+        self.changedVars.add(varId)
+        if self.wal:
+            self.wal.append({'op': 'W', 'var': varId, 'value': value, 'ts': lastWrite})
+
+    def markReadable(self, varId, ts, horizon=None):
+        '''
+        varId: name of the replicated variable
+        ts: time of the catch up
+        horizon: start time of the oldest active read-only transaction, None if there is none
 
-            # current lock is W-lock, check if the transaction holding lock is same as the one requesting in the queue
-            return (not (currentLock.transactions[0] == queuedLock.transactions[0]))
+        Makes the variable readable after a recovery when an up replica holds the same committed value, so nothing
+        is copied. A variable that was not created yet stays so and is readable once created
+        '''
 
-        def queuedBlocks(queuedBefore, queuedAfter):
-            '''
-            queuedBefore: lock appearing earlier in waiting queue
-            queuedAfter: lock apprearing later in waiting queue
+        var = self.variableList.loaded.get(varId)
+        if var is None:
+            self.caughtUpSince[varId] = ts
+        else:
+            var.isReadable = True
+            self.addVersion(var, ts, horizon)
+        self.changedVars.add(varId)
+        if self.wal:
+            self.wal.append({'op': 'readable', 'var': varId, 'ts': ts})
 
-            The method returns a boolean value indicating a conflict between the two waiting requests.
-            '''
 
-            # If both the requests are for read, there is not conflict
-            if queuedBefore.lockType == 'R' and queuedAfter.lockType == 'R':
-                return False
+############# CHECKPOINT AND RESTORE OPERATIONS ############
 
-            # at least one lock is W-lock and hence there is a conflict if the transactions are not same
-            return (not (queuedBefore.transactions[0] == queuedAfter.transactions[0]))
+    def checkpoint(self):
+        '''
+        Writes the committed state of the site to its checkpoint and empties its log
+        '''
 
-        
-        # print('\n lock table: {} \n'.format(self.lockTable))
-        graph = defaultdict(set)
+        records = ((int(varId[1:]),) + self.getCommittedState(varId) for varId in self.varOrder)
+        self.wal.writeCheckpoint(self.isUp, self.upSince, records)
 
-        for var, lm in self.lockTable.items():
-            if not lm.currentLock or len(lm.pendingRequests)==0:
-                continue
+    def restore(self):
+        '''
+        Rebuilds the committed state of the site from its checkpoint and the records logged after it.
+        Locks and uncommitted values are not restored since their transactions did not survive the restart.
+        The checkpoint is mapped in memory and only the variables in the log are created, the others are created
+        from the image when they are first used
 
-            currLock = lm.currentLock
-            
-            # Check for conflicts between current lock and pending lock requests
-
-            for req in lm.pendingRequests:
-                # check if request lock conflicts with current lock
-                if currentConflicts(currLock, req):
-                    if currLock.lockType == 'R':
-                        for t_id in currLock.transactions:
-                            # If the requesting transaction is not holding lock, add an edge in the graph
-                            if t_id != req.transactions[0]:
-                                graph[req.transactions[0]].add(t_id)
-                    else:
-                        # If current lock is write and requesting transaction is not the same as current lock
-                        # holding transaction, add an edge in the graph
-                        if currLock.transactions[0] != req.transactions[0]:
-                            graph[req.transactions[0]].add(currLock.transactions[0])
+        Returns the latest timestamp found in the checkpoint and the log, -1 if there is none
+        '''
 
-            # check for conflicts between the waiting lock requests   
+        lastTs = -1
+        image = self.wal.readCheckpoint()
+        if image:
+            if image.count != len(self.varOrder):
+                raise ValueError('Site {} holds {} variables but {} has {}'.format(self.siteId, len(self.varOrder), image.path, image.count))
+            self.image = image
+            self.isUp = image.isUp
+            self.upSince = image.upSince
+            lastTs = image.lastTs
+
+        for record in self.wal.readLog():
+            if record['op'] == 'W':
+                var = self.getRestoredVariable(record['var'])
+                var.value = record['value']
+                var.isReadable = True
+                var.lastWrite = record['ts']
+            elif record['op'] == 'readable':
+                self.getRestoredVariable(record['var']).isReadable = True
+            elif record['op'] == 'fail':
+                self.isUp = False
+            elif record['op'] == 'recover':
+                self.isUp = True
+                self.upSince = record['ts']
+                if not self.isQuorum:
+                    for var in self.variableList.loaded.values():
+                        if var.isReplicated:
+                            var.isReadable = False
+                    if self.unreadableSince is None:
+                        self.unreadableSince = record['ts']
+            lastTs = max(lastTs, record['ts'])
+
+        # Only the restored state is visible to new read only transactions
+        # The version is stamped with the last write so that quorum reads can compare the replicas
+        self.upHistory = [(-1, self.isUp)]
+        for var in self.variableList.loaded.values():
+            var.versions = [(var.lastWrite, var.value, var.isReadable)]
+
+        return lastTs
+
+    def getRestoredVariable(self, varId):
+        '''
+        varId: name of the variable found in the checkpoint or log
 
-            for i in range(len(lm.pendingRequests)):
-                for j in range(i):
-                    if queuedBlocks(lm.pendingRequests[j], lm.pendingRequests[i]):
-                        graph[lm.pendingRequests[i].transactions[0]].add(lm.pendingRequests[j].transactions[0])
+        Returns the variable, raises ValueError if the site does not hold it in the current layout
+        '''
 
-        # print("graph {}={}".format(self.siteId, dict(graph)))
-        return graph
-        
\ No newline at end of file
+        if varId not in self.variableList:
+            raise ValueError('Site {} does not hold {} logged in {}'.format(self.siteId, varId, self.wal.logPath))
+        return self.variableList[varId]
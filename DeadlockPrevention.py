@@ -0,0 +1,55 @@
+# Timestamp based deadlock prevention policies
+POLICIES = ('wait-die', 'wound-wait')
+
+class DeadlockPrevention:
+    def __init__(self, policy, transactionQueue):
+        '''
+        policy: wait-die or wound-wait
+        transactionQueue: dictionary of the transactions of the transaction manager, giving their start times
+        victims: set of the transactions to be aborted by the transaction manager. Filled as the lock requests
+                 are checked at the sites
+
+        wait-die: a transaction waits only for younger transactions. If it would wait for an older one it dies
+        wound-wait: a transaction waits only for older transactions. The younger ones it would wait for are wounded
+
+        A transaction is older if it began earlier. Since the older transaction always survives, no cycle of
+        waiting transactions can form and the waits-for graph is not needed
+        '''
+
+        if policy not in POLICIES:
+            raise ValueError('Unknown deadlock prevention policy {}'.format(policy))
+
+        self.policy = policy
+        self.transactionQueue = transactionQueue
+        self.victims = set()
+
+    def mayWait(self, trans_id, blockers):
+        '''
+        trans_id: transaction id of the requesting transaction
+        blockers: transactions the request would wait for
+
+        Returns true if the request can be queued. The transactions to be aborted are added to victims
+        Transactions that already ended are not in the transaction queue and cannot be aborted, so they are ignored
+        '''
+
+        ts = self.transactionQueue[trans_id].timestamp
+        if self.policy == 'wait-die':
+            for blocker in blockers:
+                if blocker in self.transactionQueue and self.transactionQueue[blocker].timestamp < ts:
+                    self.victims.add(trans_id)
+                    return False
+            return True
+
+        for blocker in blockers:
+            if blocker in self.transactionQueue and self.transactionQueue[blocker].timestamp > ts:
+                self.victims.add(blocker)
+        return True
+
+    def popVictims(self):
+        '''
+        Returns the victims that are still running, youngest first, and forgets all the victims
+        '''
+
+        victims = [t for t in self.victims if t in self.transactionQueue]
+        self.victims = set()
+        return sorted(victims, key=lambda t: self.transactionQueue[t].timestamp, reverse=True)
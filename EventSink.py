@@ -0,0 +1,182 @@
+import re
+import sys
+import json
+
+# Human readable format of every event. The fields of the event are substituted in the format
+TEXT_FORMATS = {
+    'begin': '{trans_id} begins',
+    'beginRO': '{trans_id} begins and is read-only',
+    'duplicate': 'transaction id {{}} already present {trans_id}',
+    'notFound': 'Transaction {trans_id} not found',
+    'invalid': 'Invalid operation',
+    'read': '{trans_id} reads {var}: {value}',
+    'readOnlyRead': '{var}: {value}',
+    'readOnlyMissing': 'var not found',
+    'write': '{trans_id} writes {var} = {value} to the sites: {sites}',
+    'commit': '{trans_id} commits',
+    'abort': '{trans_id} aborts due to {cause}',
+    'fail': 'site {site} fails',
+    'recover': 'site {site} recovers',
+    'catchUp': 'site {site} catches up: {readable} variables readable, {transferred} values copied',
+    'unresolvedLocks': 'unresolved locks',
+    'lockWarning': '{message}',
+    'statsDisabled': 'stats are not enabled',
+    'dumpUnchanged': 'no changes since the last dump',
+    'checkpoint': 'checkpoint written for {sites} sites',
+    'checkpointDisabled': 'checkpoints are not enabled',
+}
+
+class EventSink:
+    def __init__(self, out=None):
+        '''
+        out: stream to which the events are written. The current standard output is used if None
+
+        Default sink writing every event as a human readable line
+        '''
+        self.out = out
+
+    def emit(self, event, **fields):
+        '''
+        event: name of the event
+        fields: values describing the event
+
+        Writes the event to the output stream. A dump is written variable by variable
+        '''
+
+        out = self.out if self.out else sys.stdout
+        if event == 'dump':
+            self.writeDump(out, fields)
+        else:
+            print(self.format(event, fields), file=out)
+
+    def writeDump(self, out, fields):
+        '''
+        out: stream to which the dump is written
+        fields: dictionary with the site id under site and the dictionary of the values of the site under values
+
+        Writes the dump of a site as "Site <id> - var: value var: value " without building the whole line
+        '''
+
+        write = out.write
+        write('Site ' + str(fields['site']) + ' - ')
+        for var, val in fields['values'].items():
+            write(var + ': ' + str(val) + ' ')
+        write('\n')
+
+    def format(self, event, fields):
+        '''
+        event: name of the event
+        fields: dictionary of the values describing the event
+
+        Returns the human readable line of the event
+        '''
+
+        if event == 'dump':
+            # The values of the site are listed as "Site <id> - var: value var: value "
+            parts = ['Site ' + str(fields['site']) + ' - ']
+            for var, val in fields['values'].items():
+                parts.append(var + ': ' + str(val) + ' ')
+            return ''.join(parts)
+
+        if event == 'stats':
+            # One line per phase followed by one line per counter
+            lines = ['stats']
+            for phase, times in fields['phases'].items():
+                lines.append('  {}: {:.6f}s in {} calls'.format(phase, times['seconds'], times['calls']))
+            for name, count in fields['counters'].items():
+                lines.append('  {}: {}'.format(name, count))
+            return '\n'.join(lines)
+
+        return TEXT_FORMATS[event].format(**fields)
+
+    def flush(self):
+        '''
+        Flushes the output stream
+        '''
+        (self.out if self.out else sys.stdout).flush()
+
+# Values written by the commands are kept as strings, the ones matching this pattern are written as JSON numbers
+INTEGER_PATTERN = re.compile(r'-?[0-9]+')
+
+def jsonValue(val):
+    '''
+    val: value of a variable, an int for the initial values and a string for the values written by the commands
+
+    Returns the value as an int if it is an integer, so that all the values have the same type in the JSON output
+    '''
+
+    if type(val) is str and INTEGER_PATTERN.fullmatch(val):
+        return int(val)
+    return val
+
+class JsonEventSink(EventSink):
+    def format(self, event, fields):
+        '''
+        event: name of the event
+        fields: dictionary of the values describing the event
+
+        Returns the event as one JSON object with the event name under the key "event"
+        '''
+        if 'value' in fields:
+            fields['value'] = jsonValue(fields['value'])
+        if event == 'dump':
+            fields['values'] = {var: jsonValue(val) for var, val in fields['values'].items()}
+        fields['event'] = event
+        return json.dumps(fields, default=str)
+
+    def writeDump(self, out, fields):
+        '''
+        Writes the dump of a site as one JSON object
+        '''
+        print(self.format('dump', fields), file=out)
+
+class NullEventSink(EventSink):
+    def emit(self, event, **fields):
+        '''
+        Discards the event. Used for benchmarking without output cost
+        '''
+        pass
+
+class BufferedEventSink(EventSink):
+    def __init__(self, sink):
+        '''
+        sink: EventSink to which the events are passed on
+        events: list of the (event, fields) held since hold() was called. None when the events are passed on directly
+
+        Used by the SitePool so that the events of the sites called concurrently are written in the order of site id
+        '''
+        self.sink = sink
+        self.events = None
+
+    def emit(self, event, **fields):
+        '''
+        event: name of the event
+        fields: values describing the event
+
+        Holds the event if hold() was called, otherwise passes it on
+        '''
+        if self.events is None:
+            self.sink.emit(event, **fields)
+        else:
+            self.events.append((event, fields))
+
+    def hold(self):
+        '''
+        Holds the events emitted from now on until release() is called
+        '''
+        self.events = []
+
+    def release(self):
+        '''
+        Passes on the held events in the order they were emitted
+        '''
+        events = self.events
+        self.events = None
+        for event, fields in events:
+            self.sink.emit(event, **fields)
+
+    def flush(self):
+        '''
+        Flushes the sink
+        '''
+        self.sink.flush()
@@ -0,0 +1,87 @@
+class Layout:
+    def __init__(self, numSites=10, numVars=20, policy='even', replicationFactor=None):
+        '''
+        numSites: number of sites in the database. Sites are numbered from 1 to numSites
+        numVars: number of variables. Variables are named x1 to x<numVars> and xi is initialized to 10*i
+        policy: placement policy of the variables
+                even: even variables are replicated, odd variable xi is present only at site i%numSites+1
+                chained: every variable is replicated
+        replicationFactor: number of sites holding a replicated variable. Defaults to numSites.
+                           A replicated variable xi is stored at replicationFactor consecutive sites starting
+                           at site i%numSites+1
+
+        The default values reproduce the layout of 10 sites and 20 variables with even variables at all sites
+        '''
+
+        if policy not in ('even', 'chained'):
+            raise ValueError('Unknown placement policy {}'.format(policy))
+        if replicationFactor is None:
+            replicationFactor = numSites
+        if numSites < 1 or numVars < 0 or not (1 <= replicationFactor <= numSites):
+            raise ValueError('Invalid layout: {} sites, {} variables, replication factor {}'.format(numSites, numVars, replicationFactor))
+
+        self.numSites = numSites
+        self.numVars = numVars
+        self.policy = policy
+        self.replicationFactor = replicationFactor
+
+    def __repr__(self):
+        return '[sites: ' + str(self.numSites) + ', variables: ' + str(self.numVars) + ', policy: ' + self.policy + ', replication factor: ' + str(self.replicationFactor) + ']'
+
+    def isReplicated(self, i):
+        '''
+        i: index of the variable
+
+        Returns a boolean value indicating if the variable xi is stored at more than one site
+        '''
+        if self.policy == 'even' and i&1:
+            return False
+        return self.replicationFactor > 1
+
+    def getSites(self, i):
+        '''
+        i: index of the variable
+
+        Returns the sorted list of ids of the sites holding the variable xi
+        '''
+        if self.policy == 'even' and i&1:
+            return [i%self.numSites + 1]
+        return sorted((i + k)%self.numSites + 1 for k in range(self.replicationFactor))
+
+    def getVariableSites(self, var):
+        '''
+        var: variable name
+
+        Returns the sorted list of ids of the sites holding the variable, empty if there is no such variable
+        '''
+        i = var[1:]
+        if var[:1] != 'x' or not i.isdigit() or var != 'x' + str(int(i)) or not (1 <= int(i) <= self.numVars):
+            return []
+        return self.getSites(int(i))
+
+    def getSiteVariables(self, siteId):
+        '''
+        siteId: site id
+
+        Returns the sorted list of indexes of the variables stored at the site.
+        Only the variables whose index has the right remainder modulo numSites are visited
+        '''
+
+        varIndexes = []
+
+        # Replicated variable xi is at site siteId if i%numSites is one of the replicationFactor values before siteId-1
+        for k in range(self.replicationFactor):
+            r = (siteId - 1 - k)%self.numSites
+            for i in range(r if r else self.numSites, self.numVars + 1, self.numSites):
+                if self.policy == 'chained' or i&1 == 0:
+                    varIndexes.append(i)
+
+        # Odd variables are stored only at the site i%numSites+1 in the even policy
+        if self.policy == 'even':
+            r = siteId - 1
+            for i in range(r if r else self.numSites, self.numVars + 1, self.numSites):
+                if i&1:
+                    varIndexes.append(i)
+
+        varIndexes.sort()
+        return varIndexes
@@ -1,5 +1,12 @@
+from collections import OrderedDict
+from collections import Counter
+from collections import namedtuple
+
+# Pending lock request of a single transaction. lockType is R or W
+LockRequest = namedtuple('LockRequest', ['lockType', 'trans_id'])
+
 class Lock:
-    def __init__(self, var, Ltype=None, trans=[]):
+    def __init__(self, var, Ltype=None, trans=None):
         '''
         varId: name of the variable to be locked
         lockType: type of lock. R: Read W: Write
@@ -10,22 +17,132 @@ class Lock:
 
         self.varId = var
         self.lockType = Ltype
-        self.transactions = trans
+        self.transactions = trans if trans is not None else []
 
     def __repr__(self):
         return '[varId: ' + self.varId + ", lockType: " + self.lockType + ", transactions: " + str(self.transactions) + "]"
 
+class LockQueue:
+    def __init__(self):
+        '''
+        requests: Ordered dictionary of the pending LockRequests with an increasing request number as key
+        transRequests: Dictionary with transaction id as key and dictionary of the request numbers of the transaction
+                       as value. Used to remove the requests of a transaction without scanning the queue
+        writeCount: number of pending write requests
+        transWriteCount: Counter of the pending write requests of every transaction
+        requestCount: number of requests added so far, used as request number
+        '''
+
+        self.requests = OrderedDict()
+        self.transRequests = {}
+        self.writeCount = 0
+        self.transWriteCount = Counter()
+        self.requestCount = 0
+
+    def __repr__(self):
+        return str(list(self.requests.values()))
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __iter__(self):
+        return iter(self.requests.values())
+
+    def append(self, lockType, trans_id):
+        '''
+        lockType: R or W
+        trans_id: transaction id
+
+        Adds a request at the end of the queue
+        '''
+
+        self.requestCount = self.requestCount + 1
+        self.requests[self.requestCount] = LockRequest(lockType, trans_id)
+        self.transRequests.setdefault(trans_id, {})[self.requestCount] = True
+        if lockType == 'W':
+            self.writeCount = self.writeCount + 1
+            self.transWriteCount[trans_id] += 1
+
+    def forget(self, key, req):
+        '''
+        key: request number
+        req: LockRequest removed from the queue
+
+        Updates the transaction index and write counts for a request that was removed
+        '''
+
+        keys = self.transRequests[req.trans_id]
+        del keys[key]
+        if not keys:
+            del self.transRequests[req.trans_id]
+        if req.lockType == 'W':
+            self.writeCount = self.writeCount - 1
+            self.transWriteCount[req.trans_id] -= 1
+            if self.transWriteCount[req.trans_id] == 0:
+                del self.transWriteCount[req.trans_id]
+
+    def head(self):
+        '''
+        Returns the first request in the queue
+        '''
+        return next(iter(self.requests.values()))
+
+    def popHead(self):
+        '''
+        Removes and returns the first request in the queue
+        '''
+        key, req = self.requests.popitem(last=False)
+        self.forget(key, req)
+        return req
+
+    def removeTransaction(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Removes all the requests of the transaction from the queue
+        '''
+
+        for key in list(self.transRequests.get(trans_id, ())):
+            self.forget(key, self.requests.pop(key))
+
+    def hasTransaction(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Returns true if the transaction has a request in the queue
+        '''
+        return trans_id in self.transRequests
+
+    def hasWrite(self, trans_id=None):
+        '''
+        trans_id: transaction id
+
+        Returns true if there is a pending write request by a transaction other than trans_id
+        '''
+        if trans_id:
+            return self.writeCount - self.transWriteCount.get(trans_id, 0) > 0
+        return self.writeCount > 0
+
+    def clear(self):
+        '''
+        Removes all the requests from the queue
+        '''
+        self.requests.clear()
+        self.transRequests.clear()
+        self.writeCount = 0
+        self.transWriteCount.clear()
+
 class LockManager:
     def __init__(self, var):
         '''
         var: name of the variable that is managed
         currentLock: Lock that is currently held on the variable
-        pendingRequests: Requests for the lock on variable waiting in queue
+        pendingRequests: LockQueue of the requests for the lock on variable waiting in queue
         '''
 
         self.var = var
         self.currentLock = None
-        self.pendingRequests = []
+        self.pendingRequests = LockQueue()
 
     def __repr__(self):
         return '[var: ' + self.var + ", currentLock: " + str(self.currentLock) + ", pending requests: " + str(self.pendingRequests) + "]"
@@ -36,6 +153,7 @@ class LockManager:
         trans_id: transaction id
 
         Remove the lock when transaction commits 
+        Returns false if the transaction still has a pending request on the variable (unresolved locks)
         '''
         if self.currentLock and (trans_id in self.currentLock.transactions):
             self.currentLock.transactions.remove(trans_id)
@@ -43,10 +161,8 @@ class LockManager:
             if len(self.currentLock.transactions)==0:
                 self.currentLock = None
     
-        for req in self.pendingRequests:
-            if trans_id in req.transactions:
-                print('unresolved locks')
-                return False
+        if self.pendingRequests.hasTransaction(trans_id):
+            return False
 
         return True
 
@@ -54,34 +170,279 @@ class LockManager:
         '''
         trans_id: transaction id
 
-        The method returns true if there is a pending write in the queue, otherwise returns false
+        The method returns true if there is a pending write in the queue by a transaction other than trans_id,
+        otherwise returns false
         '''
 
-        for req in self.pendingRequests:
-            if req.lockType=='W':
-                if trans_id and req.transactions[0]==trans_id:
-                    continue
-                return True
-
-        return False
+        return self.pendingRequests.hasWrite(trans_id)
 
     def promoteLock(self, trans_id):
         '''
         trans_id; transaction id
+
+        Returns None if the lock was promoted, otherwise the reason why it could not be promoted
         '''
 
         # Check if a lock exists on the variable
         if not self.currentLock:
-            print("No lock present")
+            return "No lock present"
         # Check if current lock is read or not
         elif not self.currentLock.lockType == 'R':
-            print("Current lock is not R")
+            return "Current lock is not R"
         # If current lock is read, check if it can be upgraded
         elif len(self.currentLock.transactions)!=1:
-            print("Other transactions having R lock")
+            return "Other transactions having R lock"
         # Check if the only trasaction having read lock on the variable is the required transaction
         elif trans_id not in self.currentLock.transactions:
-            print("Transaction not having R lock")
+            return "Transaction not having R lock"
         # Upgrade the lock to W since all criterion matches
         else:
-            self.currentLock.lockType = "W"
\ No newline at end of file
+            self.currentLock.lockType = "W"
+            return None
+
+    def blockers(self, lockType, trans_id):
+        '''
+        lockType: R or W
+        trans_id: transaction id
+
+        Returns the set of transactions a new request would wait for: the holders of the current lock if it
+        conflicts with the request and the transactions of the conflicting requests already in the queue
+        '''
+
+        blocking = set()
+        if self.currentLock and (lockType == 'W' or self.currentLock.lockType == 'W'):
+            blocking.update(self.currentLock.transactions)
+        for req in self.pendingRequests:
+            if lockType == 'W' or req.lockType == 'W':
+                blocking.add(req.trans_id)
+        blocking.discard(trans_id)
+        return blocking
+
+    def waitsForEdges(self):
+        '''
+        The method returns a set of (waiting transaction, blocking transaction) pairs.
+        The pairs represent the transactions that conflict with one another on this variable.
+        '''
+
+        def currentConflicts(currentLock, queuedLock):
+            '''
+            currentLock: lock currently held 
+            queuedLock: pending lock request in the queue
+
+            The method returns a bool value indicating if the current lock conflicts with the pending request
+            '''
+
+            if currentLock.lockType == 'R':
+                # If queued lock is R the n it does not conflict
+                # If queued lock is W but is requested by same transaction, and it is the only transaction holding R lock, it does not conflict 
+                if queuedLock.lockType == 'R' or (len(currentLock.transactions) == 1 and queuedLock.trans_id == currentLock.transactions[0]):
+                    return False
+
+                return True
+
+            # current lock is W-lock, check if the transaction holding lock is same as the one requesting in the queue
+            return (not (currentLock.transactions[0] == queuedLock.trans_id))
+
+        def queuedBlocks(queuedBefore, queuedAfter):
+            '''
+            queuedBefore: lock appearing earlier in waiting queue
+            queuedAfter: lock apprearing later in waiting queue
+
+            The method returns a boolean value indicating a conflict between the two waiting requests.
+            '''
+
+            # If both the requests are for read, there is not conflict
+            if queuedBefore.lockType == 'R' and queuedAfter.lockType == 'R':
+                return False
+
+            # at least one lock is W-lock and hence there is a conflict if the transactions are not same
+            return (not (queuedBefore.trans_id == queuedAfter.trans_id))
+
+        edges = set()
+
+        if not self.currentLock or len(self.pendingRequests)==0:
+            return edges
+
+        currLock = self.currentLock
+        pending = list(self.pendingRequests)
+
+        # Check for conflicts between current lock and pending lock requests
+
+        for req in pending:
+            # check if request lock conflicts with current lock
+            if currentConflicts(currLock, req):
+                if currLock.lockType == 'R':
+                    for t_id in currLock.transactions:
+                        # If the requesting transaction is not holding lock, add an edge
+                        if t_id != req.trans_id:
+                            edges.add((req.trans_id, t_id))
+                else:
+                    # If current lock is write and requesting transaction is not the same as current lock
+                    # holding transaction, add an edge
+                    if currLock.transactions[0] != req.trans_id:
+                        edges.add((req.trans_id, currLock.transactions[0]))
+
+        # check for conflicts between the waiting lock requests   
+        # Only the edges to the nearest conflicting requests are added: a read request waits for the last write
+        # queued before it, a write request for that write and the reads queued after it. The earlier requests are
+        # reached through the edges of that write, so the cycles are the same as with an edge to every conflicting
+        # request and the number of edges grows linearly with the queue
+
+        lastWrite = None
+        readsSinceWrite = []
+        for req in pending:
+            if req.lockType == 'R':
+                if lastWrite and queuedBlocks(lastWrite, req):
+                    edges.add((req.trans_id, lastWrite.trans_id))
+                readsSinceWrite.append(req)
+            else:
+                if lastWrite:
+                    readsSinceWrite.append(lastWrite)
+                for before in readsSinceWrite:
+                    if queuedBlocks(before, req):
+                        edges.add((req.trans_id, before.trans_id))
+                lastWrite = req
+                readsSinceWrite = []
+
+        return edges
+
+# Modes of the site lock. IS and IX announce read and write locks on variables of the site, S and X lock every
+# variable of the site for reading and writing, SIX is S together with IX
+SITE_MODES = ('IS', 'IX', 'S', 'SIX', 'X')
+
+# Pairs of site lock modes that can be held by different transactions at the same time
+COMPATIBLE_MODES = {('IS', 'IS'), ('IS', 'IX'), ('IS', 'S'), ('IS', 'SIX'), ('IX', 'IS'), ('IX', 'IX'),
+                    ('S', 'IS'), ('S', 'S'), ('SIX', 'IS')}
+
+# Weakest mode covering both modes of a pair. The modes missing from the table combine to SIX or X
+MODE_COMBINATIONS = {('IS', 'IX'): 'IX', ('IS', 'S'): 'S', ('IS', 'SIX'): 'SIX', ('IX', 'S'): 'SIX',
+                     ('IX', 'SIX'): 'SIX', ('S', 'SIX'): 'SIX'}
+
+# Name under which the site lock is known to the waits-for graph. It is not the name of a variable
+SITE_LOCK = '*site'
+
+
+def combineModes(mode, other):
+    '''
+    mode: site lock mode, None if no mode is held
+    other: site lock mode
+
+    Returns the weakest mode covering both modes
+    '''
+
+    if mode is None or mode == other:
+        return other
+    if 'X' in (mode, other):
+        return 'X'
+    return MODE_COMBINATIONS.get((mode, other)) or MODE_COMBINATIONS[(other, mode)]
+
+
+class SiteLockManager(LockManager):
+    def __init__(self):
+        '''
+        modes: Dictionary with transaction id as key and the site lock mode held by the transaction as value
+        pendingRequests: LockQueue of the mode requests waiting for the site lock. The lockType of a request is the
+                         mode wanted by the transaction
+        waitingVars: Dictionary with transaction id as key and set of the variables whose lock requests wait for
+                     the site lock as value
+
+        Lock on the whole site for multi-granularity locking. A transaction needs IS or IX on the site before
+        locking a variable of the site, while S or X on the site stand for locks on all its variables
+        '''
+
+        LockManager.__init__(self, SITE_LOCK)
+        self.modes = {}
+        self.waitingVars = {}
+
+    def __repr__(self):
+        return '[site lock: ' + str(self.modes) + ", pending requests: " + str(self.pendingRequests) + "]"
+
+    def conflicts(self, mode, trans_id):
+        '''
+        mode: site lock mode
+        trans_id: transaction id
+
+        Returns the set of the transactions other than trans_id holding a mode that is not compatible with mode
+        '''
+        return {t for t, held in self.modes.items() if t != trans_id and (mode, held) not in COMPATIBLE_MODES}
+
+    def acquire(self, mode, trans_id):
+        '''
+        mode: site lock mode needed by the transaction
+        trans_id: transaction id
+
+        Gives the transaction the weakest mode covering the mode it holds and the needed one if that mode is
+        compatible with the modes of the other transactions. A transaction without a mode does not overtake the
+        waiting requests. Returns true if the transaction holds the needed mode
+        '''
+
+        held = self.modes.get(trans_id)
+        wanted = combineModes(held, mode)
+        if wanted == held:
+            return True
+        if (held is None and len(self.pendingRequests)) or self.conflicts(wanted, trans_id):
+            return False
+        self.modes[trans_id] = wanted
+        return True
+
+    def covers(self, trans_id, lockType):
+        '''
+        trans_id: transaction id
+        lockType: R or W
+
+        Returns true if the site lock of the transaction stands for the lock on every variable of the site
+        '''
+        held = self.modes.get(trans_id)
+        return held == 'X' or (lockType == 'R' and held in ('S', 'SIX'))
+
+    def exclusiveHolder(self):
+        '''
+        Returns the transaction holding X on the site, None if there is none
+        '''
+        for t, held in self.modes.items():
+            if held == 'X':
+                return t
+        return None
+
+    def removeLocks(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Releases the mode and removes the waiting requests of the transaction
+        '''
+        self.modes.pop(trans_id, None)
+        self.pendingRequests.removeTransaction(trans_id)
+        self.waitingVars.pop(trans_id, None)
+        return True
+
+    def blockers(self, lockType, trans_id):
+        '''
+        lockType: site lock mode
+        trans_id: transaction id
+
+        Returns the set of transactions a new mode request would wait for
+        '''
+
+        blocking = self.conflicts(combineModes(self.modes.get(trans_id), lockType), trans_id)
+        for req in self.pendingRequests:
+            if req.trans_id != trans_id and (lockType, req.lockType) not in COMPATIBLE_MODES:
+                blocking.add(req.trans_id)
+        return blocking
+
+    def waitsForEdges(self):
+        '''
+        The method returns a set of (waiting transaction, blocking transaction) pairs for the waiting mode requests.
+        A request waits for the holders of incompatible modes and the incompatible requests queued before it
+        '''
+
+        edges = set()
+        pending = list(self.pendingRequests)
+        for i in range(len(pending)):
+            req = pending[i]
+            wanted = combineModes(self.modes.get(req.trans_id), req.lockType)
+            for t in self.conflicts(wanted, req.trans_id):
+                edges.add((req.trans_id, t))
+            for j in range(i):
+                if pending[j].trans_id != req.trans_id and (pending[j].lockType, req.lockType) not in COMPATIBLE_MODES:
+                    edges.add((req.trans_id, pending[j].trans_id))
+        return edges
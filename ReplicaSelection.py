@@ -0,0 +1,95 @@
+class FirstSite:
+    '''
+    Tries the up sites holding the variable in the order of site id. This is the default policy
+    '''
+
+    def order(self, transaction, var, sites, isNew):
+        '''
+        transaction: Transaction performing the read
+        var: variable name
+        sites: data managers of the up sites holding the variable, in the order of site id
+        isNew: Indicates if the read is tried for the first time
+
+        Returns the data managers in the order they are tried by the read
+        '''
+        return sites
+
+    def forget(self, trans_id):
+        '''
+        trans_id: transaction id
+
+        Called when the transaction commits or aborts
+        '''
+        pass
+
+class RoundRobin(FirstSite):
+    def __init__(self):
+        '''
+        nextStart: Dictionary with variable name as key and the number of new reads of the variable as value
+        starts: Dictionary with transaction id as key and dictionary of the start position of every variable
+                read by the transaction as value. A retried read starts at the same site as the first try
+
+        Every new read of a variable starts at the site after the one the previous read started at
+        '''
+        self.nextStart = {}
+        self.starts = {}
+
+    def order(self, transaction, var, sites, isNew):
+        '''
+        Returns the data managers rotated to the start position of the read
+        '''
+
+        if not sites:
+            return sites
+
+        starts = self.starts.setdefault(transaction.trans_id, {})
+        if isNew or var not in starts:
+            starts[var] = self.nextStart.get(var, 0)
+            self.nextStart[var] = starts[var] + 1
+
+        start = starts[var] % len(sites)
+        return sites[start:] + sites[:start]
+
+    def forget(self, trans_id):
+        self.starts.pop(trans_id, None)
+
+class LeastLoaded(FirstSite):
+    '''
+    Tries the sites with the fewest pending lock requests on the variable first. Among them the sites where fewer
+    transactions hold the lock come first, then the order of site id
+    '''
+
+    def order(self, transaction, var, sites, isNew):
+        return sorted(sites, key=self.load(var))
+
+    def load(self, var):
+        '''
+        var: variable name
+
+        Returns the function giving the (pending requests, lock holders) of the variable at a site
+        '''
+
+        def siteLoad(dm):
+            # A lock manager that was not created yet has no lock and no request
+            lockManager = dm.lockTable.loaded.get(var)
+            if lockManager is None:
+                return (0, 0)
+            holders = len(lockManager.currentLock.transactions) if lockManager.currentLock else 0
+            return (len(lockManager.pendingRequests), holders)
+
+        return siteLoad
+
+class Sticky(FirstSite):
+    '''
+    Tries the sites already accessed by the transaction first, so that its locks are spread over as few sites
+    as possible, followed by the other sites in the order of site id
+    '''
+
+    def order(self, transaction, var, sites, isNew):
+        accessed = transaction.accessedSites
+        if not accessed:
+            return sites
+        return [dm for dm in sites if dm.siteId in accessed] + [dm for dm in sites if dm.siteId not in accessed]
+
+# Replica selection policies selectable by name
+REPLICA_POLICIES = {'first': FirstSite, 'round-robin': RoundRobin, 'least-loaded': LeastLoaded, 'sticky': Sticky}
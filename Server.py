@@ -0,0 +1,215 @@
+import os
+import asyncio
+from EventSink import EventSink
+from TransactionManager import TOKEN_PATTERN
+
+# Commands accepted on the admin listener
+ADMIN_COMMANDS = {'dump', 'stats'}
+
+
+class RoutingEventSink(EventSink):
+    def __init__(self, formatter=None):
+        '''
+        formatter: EventSink whose format() turns an event into a line. Uses the human readable EventSink if None
+        owners: Dictionary with transaction id as key and the client that began the transaction as value
+        current: client whose command is being processed
+        pending: Dictionary with client as key and list of the lines to be sent to it as value
+
+        An event of a transaction goes to the client that began the transaction. The other events, the events of
+        transactions whose client is gone and the rejected duplicate begins go to the client whose command is
+        being processed
+        '''
+
+        super().__init__()
+        self.formatter = formatter if formatter else EventSink()
+        self.owners = {}
+        self.current = None
+        self.pending = {}
+
+    def emit(self, event, **fields):
+        '''
+        event: name of the event
+        fields: values describing the event
+
+        Adds the line of the event to the lines of the client it is routed to
+        '''
+
+        trans_id = fields.get('trans_id')
+        client = self.owners.get(trans_id, self.current) if event != 'duplicate' else self.current
+        if event == 'commit' or event == 'abort':
+            self.owners.pop(trans_id, None)
+        if client is None or client.closed:
+            client = self.current
+        if client is None:
+            return
+        self.pending.setdefault(client, []).append(self.formatter.format(event, fields) + '\n')
+
+    def flush(self):
+        '''
+        Sends the pending lines to their clients
+        '''
+
+        for client, lines in self.pending.items():
+            client.send(''.join(lines))
+        self.pending = {}
+
+
+class Client:
+    def __init__(self, writer, isAdmin=False):
+        '''
+        writer: asyncio StreamWriter of the connection
+        isAdmin: Indicates if the client connected to the admin listener. Admin clients can only run dump and stats
+        closed: Indicates if the connection is closed
+        '''
+
+        self.writer = writer
+        self.isAdmin = isAdmin
+        self.closed = False
+
+    def send(self, text):
+        '''
+        text: lines to be written to the client
+        '''
+
+        if not self.closed:
+            self.writer.write(text.encode())
+
+    def close(self):
+        '''
+        Closes the connection
+        '''
+
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class CommandServer:
+    def __init__(self, tm, sink):
+        '''
+        tm: TransactionManager shared by all the clients
+        sink: RoutingEventSink given to the transaction manager
+        commands: asyncio Queue of the (client, command) pairs waiting for the tick loop
+        servers: list of the asyncio servers that are listening
+
+        Accepts many client connections and multiplexes their commands onto one tick loop. Every command is one tick
+        of the transaction manager, in the order the commands arrived
+        '''
+
+        self.tm = tm
+        self.sink = sink
+        self.commands = None
+        self.servers = []
+
+    async def start(self, address, isAdmin=False):
+        '''
+        address: host:port of a TCP socket or path of a Unix socket
+        isAdmin: Indicates if the listener is the admin channel
+
+        Starts listening on the address
+        '''
+
+        if self.commands is None:
+            self.commands = asyncio.Queue()
+
+        def handler(reader, writer):
+            return self.serveClient(reader, writer, isAdmin)
+
+        host, sep, port = address.rpartition(':')
+        if sep and port.isdigit():
+            server = await asyncio.start_server(handler, host or None, int(port))
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(handler, address)
+        self.servers.append(server)
+
+    async def serveClient(self, reader, writer, isAdmin):
+        '''
+        reader: asyncio StreamReader of the connection
+        writer: asyncio StreamWriter of the connection
+        isAdmin: Indicates if the client connected to the admin listener
+
+        Reads the commands of the client line by line and puts them on the queue of the tick loop until the client
+        sends exit or closes the connection. The connection is closed by the tick loop once the output of the
+        commands before exit was sent
+        '''
+
+        client = Client(writer, isAdmin)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or line.strip() == b'exit':
+                    break
+                command = line.decode().strip()
+                if command:
+                    await self.commands.put((client, command))
+                await writer.drain()
+        except ConnectionError:
+            client.close()
+        await self.commands.put((client, None))
+
+    def process(self, client, command):
+        '''
+        client: client that sent the command
+        command: the command, None if the client is leaving
+
+        Runs one tick of the transaction manager for the command
+        '''
+
+        if command is None:
+            return
+
+        tokens = TOKEN_PATTERN.findall(command)
+        self.sink.current = client
+        if not tokens or (client.isAdmin and tokens[0] not in ADMIN_COMMANDS):
+            self.sink.emit('invalid')
+            return
+
+        if tokens[0] in ('begin', 'beginRO') and len(tokens) > 1 and tokens[1] not in self.tm.transactionQueue:
+            self.sink.owners[tokens[1]] = client
+
+        try:
+            self.tm.processLine(command)
+        except (IndexError, ValueError):
+            # Commands with missing or malformed arguments
+            self.sink.emit('invalid')
+
+    async def tickLoop(self):
+        '''
+        Processes the queued commands one tick at a time and sends the output of every batch of ticks to the clients
+        '''
+
+        while True:
+            leaving = []
+            client, command = await self.commands.get()
+            while True:
+                self.process(client, command)
+                if command is None:
+                    leaving.append(client)
+                if self.commands.empty():
+                    break
+                client, command = self.commands.get_nowait()
+
+            self.sink.current = None
+            self.sink.flush()
+            for client in leaving:
+                client.close()
+
+    async def serve(self, address, adminAddress=None):
+        '''
+        address: address of the listener of the clients
+        adminAddress: address of the admin listener, None if there is no admin channel
+
+        Starts the listeners and runs the tick loop until cancelled
+        '''
+
+        await self.start(address)
+        if adminAddress:
+            await self.start(adminAddress, True)
+
+        try:
+            await self.tickLoop()
+        finally:
+            for server in self.servers:
+                server.close()
@@ -0,0 +1,115 @@
+import os
+import mmap
+import struct
+
+# Header of a site image: magic, format version, isUp, upSince, number of records, latest timestamp, offset of the
+# text values
+HEADER = struct.Struct('<4sHBxqqqq')
+MAGIC = b'RCSI'
+FORMAT_VERSION = 1
+
+# Record of a variable: index of the variable, flags, value, lastWrite. A value that is not a 64 bit integer is
+# stored in the text section and the record holds its offset
+RECORD = struct.Struct('<iBxxxqq')
+TEXT_LENGTH = struct.Struct('<I')
+
+# Flags of a record
+READABLE = 1
+TEXT_VALUE = 2
+INT_TEXT = 4
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+def writeSiteImage(path, isUp, upSince, records):
+    '''
+    path: file to be written
+    isUp: Indicates if the site is up
+    upSince: time since when the site is up
+    records: iterable of (variable index, value, lastWrite, isReadable) in the order of the variables at the site
+
+    Writes the state of a site as a header followed by one fixed size record per variable and the text values
+    '''
+
+    body = bytearray()
+    texts = bytearray()
+    count = 0
+    lastTs = upSince
+
+    for index, value, lastWrite, isReadable in records:
+        flags = READABLE if isReadable else 0
+        if type(value) is int and INT64_MIN <= value <= INT64_MAX:
+            stored = value
+        else:
+            flags = flags | TEXT_VALUE | (INT_TEXT if type(value) is int else 0)
+            stored = len(texts)
+            text = str(value).encode()
+            texts += TEXT_LENGTH.pack(len(text)) + text
+        body += RECORD.pack(index, flags, stored, lastWrite)
+        count = count + 1
+        lastTs = max(lastTs, lastWrite)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 1 if isUp else 0, upSince, count, lastTs,
+                            HEADER.size + len(body)))
+        f.write(body)
+        f.write(texts)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SiteImage:
+    def __init__(self, path):
+        '''
+        path: file written by writeSiteImage
+        isUp: Indicates if the site was up
+        upSince: time since when the site was up
+        count: number of variables
+        lastTs: latest timestamp found in the image
+        textOffset: offset of the text values in the file
+        data: read only memory map of the file. A record is only decoded when its variable is first used
+
+        Raises ValueError if the file is not a site image
+        '''
+
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('{} is not a site image'.format(path))
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, isUp, self.upSince, self.count, self.lastTs, self.textOffset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('{} is not a site image'.format(path))
+        self.isUp = bool(isUp)
+        self.path = path
+
+    def read(self, position, index):
+        '''
+        position: position of the variable at the site
+        index: index of the variable expected at that position
+
+        Returns the (value, lastWrite, isReadable) of the variable.
+        Raises ValueError if the image was written for another layout
+        '''
+
+        recordIndex, flags, value, lastWrite = RECORD.unpack_from(self.data, HEADER.size + position * RECORD.size)
+        if recordIndex != index:
+            raise ValueError('{} holds x{} where x{} is expected'.format(self.path, recordIndex, index))
+
+        if flags & TEXT_VALUE:
+            start = self.textOffset + value
+            length, = TEXT_LENGTH.unpack_from(self.data, start)
+            start = start + TEXT_LENGTH.size
+            value = self.data[start:start + length].decode()
+            if flags & INT_TEXT:
+                value = int(value)
+
+        return (value, lastWrite, bool(flags & READABLE))
+
+    def close(self):
+        '''
+        Unmaps the file
+        '''
+        self.data.close()
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from EventSink import BufferedEventSink
+
+# A worker is only sent a message if it gets at least this many calls. Sending a message to a worker costs more than
+# running the calls of a few sites, so a fan-out uses as many workers as it can fill and smaller fan-outs are run by
+# the calling thread
+MIN_CALLS_PER_WORKER = 4
+
+class SitePool:
+    def __init__(self, dataManagers, workers):
+        '''
+        dataManagers: Array of the data managers, indexed by site id - 1
+        workers: largest number of workers. In a fan-out using n workers, site i is served by the worker (i-1) % n
+        executors: Array of single thread executors of the workers after the first one. The first worker is the
+                   calling thread, which runs its sites while the other workers run theirs
+
+        A fan-out sends one message to every worker, holding the calls of all the sites of the worker, instead of
+        one message per site. The calls of a site run one at a time and in the order they were sent since every
+        fan-out waits for all the workers to answer.
+
+        The sink of every data manager is wrapped in a BufferedEventSink. The events emitted while a site runs a call
+        are held and written after all the sites answered, in the order of site id, so the output is the same as when
+        the sites are called one after another
+        '''
+
+        self.dataManagers = dataManagers
+        self.workers = max(1, min(workers, len(dataManagers)))
+        self.executors = [ThreadPoolExecutor(max_workers=1) for i in range(self.workers - 1)]
+
+        for dm in dataManagers:
+            dm.sink = BufferedEventSink(dm.sink)
+
+    def run(self, tasks):
+        '''
+        tasks: list of (site id, function, arguments) tuples
+
+        Runs every function in the worker of its site, the functions of a worker one after another in a single
+        message, and returns the results in the order of tasks. Only the workers that get at least
+        MIN_CALLS_PER_WORKER calls are used, a fan-out too small for two workers is run by the calling thread
+        '''
+
+        workers = min(self.workers, len(tasks) // MIN_CALLS_PER_WORKER)
+        if workers <= 1:
+            return [function(*args) for siteId, function, args in tasks]
+
+        batches = [[] for i in range(workers)]
+        for position, (siteId, function, args) in enumerate(tasks):
+            batches[(siteId - 1) % workers].append((position, function, args))
+
+        results = [None] * len(tasks)
+
+        def runBatch(batch):
+            for position, function, args in batch:
+                results[position] = function(*args)
+
+        futures = [executor.submit(runBatch, batch) for executor, batch in zip(self.executors, batches[1:]) if batch]
+        try:
+            runBatch(batches[0])
+        finally:
+            # The other workers are waited for even if a call failed, so that no site is still running afterwards
+            wait(futures)
+        for future in futures:
+            future.result()
+
+        return results
+
+    def call(self, dataManagers, method, *args):
+        '''
+        dataManagers: data managers to be called
+        method: name of the DataManager method
+        args: arguments of the method
+
+        Calls the method on every data manager concurrently and returns the results in the order of dataManagers
+        '''
+
+        if len(dataManagers) <= 1:
+            return [getattr(dm, method)(*args) for dm in dataManagers]
+
+        for dm in dataManagers:
+            dm.sink.hold()
+
+        try:
+            return self.run([(dm.siteId, getattr(dm, method), args) for dm in dataManagers])
+        finally:
+            for dm in dataManagers:
+                dm.sink.release()
+
+    def map(self, function, items):
+        '''
+        function: function of one item
+        items: list of (site id, item) pairs
+
+        Runs the function on every item in the worker of its site and returns the results in the order of items
+        '''
+        return self.run([(siteId, function, (item,)) for siteId, item in items])
+
+    def close(self):
+        '''
+        Stops the workers
+        '''
+
+        for executor in self.executors:
+            executor.shutdown()
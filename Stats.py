@@ -0,0 +1,46 @@
+import threading
+from collections import Counter
+
+class Stats:
+    def __init__(self):
+        '''
+        counters: Counter of the events counted by the transaction manager and data managers, for example
+                  lock grants, lock waits, deadlock cycles, aborts by cause and retried operations
+        phaseTimes: Counter of the wall time in seconds spent in every phase of processLine
+        phaseCalls: Counter of the number of times every phase ran
+        lock: lock taken while a counter is updated, since the sites may count from their worker threads
+
+        Statistics are only collected when a Stats object is given to the TransactionManager
+        '''
+
+        self.counters = Counter()
+        self.phaseTimes = Counter()
+        self.phaseCalls = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        '''
+        name: name of the counter
+        n: amount added to the counter
+        '''
+        with self.lock:
+            self.counters[name] += n
+
+    def addTime(self, phase, seconds):
+        '''
+        phase: name of the phase
+        seconds: wall time spent in the phase
+        '''
+        self.phaseTimes[phase] += seconds
+        self.phaseCalls[phase] += 1
+
+    def summary(self):
+        '''
+        Returns a dictionary with the phase times and calls and the counters, sorted by name
+        '''
+
+        phases = {}
+        for phase in self.phaseTimes.keys():
+            phases[phase] = {'seconds': self.phaseTimes[phase], 'calls': self.phaseCalls[phase]}
+
+        return {'phases': phases, 'counters': dict(sorted(self.counters.items()))}
@@ -0,0 +1,453 @@
+import re
+import json
+import time
+import struct
+from collections import defaultdict
+from EventSink import EventSink
+from EventSink import NullEventSink
+from Layout import Layout
+from Stats import Stats
+
+# Header of a trace: magic, format version, length of the JSON configuration of the engine that follows
+HEADER = struct.Struct('<4sHI')
+MAGIC = b'RCTR'
+FORMAT_VERSION = 2
+
+# Kinds of the records. Every string is written once in a STRING record and referred to by its id afterwards,
+# ids being given in the order the strings appear. The lengths, ids and integers of the records are varints
+# STRING: length, text
+# COMMAND: number of tokens of the command, then every token as a tagged value
+# EVENT: id of the shape of the event, its name followed by the names of its fields separated by spaces, then the
+#        tagged value of every field
+# GRANT, WAIT: site id, id of the transaction, id of the variable
+STRING = 0
+COMMAND = 1
+EVENT = 2
+GRANT = 3
+WAIT = 4
+
+# Tags of the field values of an event. A tagged value starts with the varint of (n << 3) | tag, where n is the
+# integer, the string id or the number of items. Lists and dictionaries hold tagged values, the keys of a
+# dictionary are string ids. A string holding an integer, such as a value written by a command, is stored as the
+# integer. Other values are stored as the id of their JSON text
+INT_VALUE = 0
+STR_VALUE = 1
+LIST_VALUE = 2
+DICT_VALUE = 3
+JSON_VALUE = 4
+INT_TEXT_VALUE = 5
+
+# Strings stored as INT_TEXT_VALUE, the ones that str(int()) gives back unchanged
+INT_TEXT_PATTERN = re.compile(r'-?[1-9][0-9]*|0')
+
+# Events left out of the trace because they depend on the wall time
+UNTRACED_EVENTS = {'stats'}
+
+
+class TraceRecorder:
+    def __init__(self, path, config):
+        '''
+        path: file to which the trace is written
+        config: dictionary with the configuration of the engine, see getConfig. Written in the header so that the
+                replay builds the same engine
+        out: trace file opened for writing with a large buffer
+        strings: Dictionary with the strings written so far as keys and their id as value
+        command: tokens of the command of the current tick
+        events: list of the encoded records of the events emitted during the tick, in the order they were emitted
+        locks: Dictionary with site id as key and list of the (kind, trans_id, var) lock decisions of the site during
+               the tick as value. Each site only appends to its own list, so the sites may run in worker threads
+
+        Records every processed command followed by the decisions of the engine during its tick: the events (reads,
+        writes, commits, aborts with their cause, ...) and the lock grants and waits at every site
+        '''
+
+        self.out = open(path, 'wb', buffering=1 << 20)
+        self.strings = {}
+        self.command = None
+        self.events = []
+        self.locks = defaultdict(list)
+
+        text = json.dumps(config, sort_keys=True).encode()
+        self.out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(text)))
+        self.out.write(text)
+
+    def beginTick(self, tokens):
+        '''
+        tokens: tokens of the command processed in the tick. The processing only depends on them
+
+        Forgets the decisions of a tick that did not complete
+        '''
+        self.command = tokens
+        self.events = []
+        self.locks = defaultdict(list)
+
+    def event(self, event, fields):
+        '''
+        event: name of the event
+        fields: dictionary of the values describing the event
+        '''
+        if event not in UNTRACED_EVENTS:
+            record = bytearray((EVENT,))
+            record += varint(self.intern(' '.join([event] + list(fields))))
+            for value in fields.values():
+                self.encodeValue(value, record)
+            self.events.append(record)
+
+    def encodeValue(self, value, record):
+        '''
+        value: value of a field of an event
+        record: bytearray to which the tagged value is appended
+        '''
+
+        if type(value) is int:
+            record += varint(zigzag(value) << 3 | INT_VALUE)
+        elif type(value) is str:
+            if INT_TEXT_PATTERN.fullmatch(value):
+                record += varint(zigzag(int(value)) << 3 | INT_TEXT_VALUE)
+            else:
+                record += varint(self.intern(value) << 3 | STR_VALUE)
+        elif type(value) is list or type(value) is tuple:
+            record += varint(len(value) << 3 | LIST_VALUE)
+            for item in value:
+                self.encodeValue(item, record)
+        elif type(value) is dict:
+            record += varint(len(value) << 3 | DICT_VALUE)
+            for key, item in value.items():
+                record += varint(self.intern(str(key)))
+                self.encodeValue(item, record)
+        else:
+            record += varint(self.intern(json.dumps(value, default=str)) << 3 | JSON_VALUE)
+
+    def lock(self, siteId, trans_id, var, isQueued):
+        '''
+        siteId: site id
+        trans_id: transaction id
+        var: name of the variable
+        isQueued: Indicates if the request was queued instead of granted
+        '''
+        self.locks[siteId].append((WAIT if isQueued else GRANT, trans_id, var))
+
+    def endTick(self):
+        '''
+        Writes the command and the decisions of the tick. The lock decisions are written in the order of site id
+        so that the trace does not depend on the worker threads
+        '''
+
+        tick = bytearray((COMMAND,))
+        tick += varint(len(self.command))
+        for token in self.command:
+            self.encodeValue(token, tick)
+        for record in self.events:
+            tick += record
+        for siteId in sorted(self.locks):
+            for kind, trans_id, var in self.locks[siteId]:
+                tick.append(kind)
+                tick += varint(siteId) + varint(self.intern(trans_id)) + varint(self.intern(var))
+        self.out.write(tick)
+        self.command = None
+
+    def intern(self, text):
+        '''
+        text: string referred to by a record
+
+        Returns the id of the string, writing it first if it is new
+        '''
+
+        stringId = self.strings.get(text)
+        if stringId is None:
+            stringId = self.strings[text] = len(self.strings)
+            data = text.encode()
+            self.out.write(bytes((STRING,)) + varint(len(data)) + data)
+        return stringId
+
+    def close(self):
+        '''
+        Writes the buffered records and closes the trace
+        '''
+        self.out.close()
+
+
+class TraceSink(EventSink):
+    def __init__(self, sink, recorder):
+        '''
+        sink: EventSink to which the events are passed on
+        recorder: TraceRecorder recording the events
+        '''
+        self.sink = sink
+        self.recorder = recorder
+
+    def emit(self, event, **fields):
+        self.recorder.event(event, fields)
+        self.sink.emit(event, **fields)
+
+    def flush(self):
+        self.sink.flush()
+
+
+def canonicalEvent(event, fields):
+    '''
+    event: name of the event
+    fields: dictionary of the values describing the event
+
+    Returns the event as a JSON text with sorted keys, so that equal events have equal texts. Used to compare the
+    replayed events with the decoded ones
+    '''
+    return event + ' ' + json.dumps(fields, sort_keys=True, default=str)
+
+
+def varint(n):
+    '''
+    n: non negative integer
+
+    Returns the integer encoded in 7 bit groups, the lowest group first and the high bit set on all but the last
+    '''
+
+    data = bytearray()
+    while n > 0x7f:
+        data.append((n & 0x7f) | 0x80)
+        n = n >> 7
+    data.append(n)
+    return data
+
+
+def readVarint(data, offset):
+    '''
+    data: bytes of the trace
+    offset: offset of a varint
+
+    Returns the integer and the offset after it
+    '''
+
+    n = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset = offset + 1
+        n = n | ((byte & 0x7f) << shift)
+        if byte < 0x80:
+            return n, offset
+        shift = shift + 7
+
+
+def zigzag(n):
+    '''
+    Returns the integer as a non negative one, the negative integers being odd, so that small integers have short
+    varints
+    '''
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def unzigzag(n):
+    '''
+    Returns the integer encoded by zigzag()
+    '''
+    return n >> 1 if n & 1 == 0 else -((n + 1) >> 1)
+
+
+def decodeValue(data, offset, strings):
+    '''
+    data: bytes of the trace
+    offset: offset of a tagged value
+    strings: list of the strings read so far, indexed by id
+
+    Returns the value and the offset after it
+    '''
+
+    n, offset = readVarint(data, offset)
+    tag = n & 7
+    n = n >> 3
+    if tag == INT_VALUE:
+        return unzigzag(n), offset
+    if tag == STR_VALUE:
+        return strings[n], offset
+    if tag == LIST_VALUE:
+        items = []
+        for i in range(n):
+            item, offset = decodeValue(data, offset, strings)
+            items.append(item)
+        return items, offset
+    if tag == DICT_VALUE:
+        items = {}
+        for i in range(n):
+            keyId, offset = readVarint(data, offset)
+            items[strings[keyId]], offset = decodeValue(data, offset, strings)
+        return items, offset
+    if tag == JSON_VALUE:
+        return json.loads(strings[n]), offset
+    if tag == INT_TEXT_VALUE:
+        return str(unzigzag(n)), offset
+    raise ValueError('unknown value tag {} at offset {}'.format(tag, offset))
+
+
+def commandText(tokens):
+    '''
+    tokens: tokens of a command
+
+    Returns the command written as name(argument,argument,...), which gives the same tokens
+    '''
+    return tokens[0] + '(' + ','.join(tokens[1:]) + ')'
+
+
+def tickDecisions(command, events, locks):
+    '''
+    command: tokens of the command of the tick
+    events: canonical texts of the events of the tick
+    locks: Dictionary with site id as key and list of the (kind, trans_id, var) lock decisions as value
+
+    Returns the list of the records of the tick as tuples, the command first
+    '''
+
+    decisions = [(COMMAND, commandText(command))]
+    decisions.extend((EVENT, event) for event in events)
+    for siteId in sorted(locks):
+        decisions.extend((kind, siteId, trans_id, var) for kind, trans_id, var in locks[siteId])
+    return decisions
+
+
+def getConfig(layout, catchUp=False, prevention=None, quorum=None, replicaPolicy='first', escalation=None,
+              stats=False):
+    '''
+    Returns the dictionary of the engine configuration written in the header of a trace. stats tells if the engine
+    collects statistics, since the stats command is only answered by a stats event when it does
+    '''
+    return {'sites': layout.numSites, 'variables': layout.numVars, 'placement': layout.policy,
+            'replicationFactor': layout.replicationFactor, 'catchUp': catchUp, 'prevention': prevention,
+            'quorum': list(quorum) if quorum else None, 'replicaPolicy': replicaPolicy, 'escalation': escalation,
+            'stats': stats}
+
+
+def readTrace(path):
+    '''
+    path: trace file written by a TraceRecorder
+
+    Returns the configuration of the engine and a generator of the ticks of the trace. A tick is the list of its
+    records as returned by tickDecisions. Raises ValueError if the file is not a trace
+    '''
+
+    f = open(path, 'rb')
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        f.close()
+        raise ValueError('{} is not a trace'.format(path))
+    magic, version, length = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        f.close()
+        raise ValueError('{} is not a trace'.format(path))
+    config = json.loads(f.read(length).decode())
+
+    def ticks():
+        strings = []
+        tick = None
+        with f:
+            data = f.read()
+        offset = 0
+        try:
+            while offset < len(data):
+                kind = data[offset]
+                offset = offset + 1
+                if kind == STRING:
+                    length, offset = readVarint(data, offset)
+                    strings.append(data[offset:offset + length].decode())
+                    offset = offset + length
+                elif kind == COMMAND:
+                    count, offset = readVarint(data, offset)
+                    tokens = []
+                    for i in range(count):
+                        token, offset = decodeValue(data, offset, strings)
+                        tokens.append(token)
+                    if tick is not None:
+                        yield tick
+                    tick = [(COMMAND, commandText(tokens))]
+                elif kind == EVENT:
+                    shapeId, offset = readVarint(data, offset)
+                    names = strings[shapeId].split(' ')
+                    fields = {}
+                    for name in names[1:]:
+                        fields[name], offset = decodeValue(data, offset, strings)
+                    tick.append((EVENT, canonicalEvent(names[0], fields)))
+                elif kind == GRANT or kind == WAIT:
+                    siteId, offset = readVarint(data, offset)
+                    transId, offset = readVarint(data, offset)
+                    varId, offset = readVarint(data, offset)
+                    tick.append((kind, siteId, strings[transId], strings[varId]))
+                else:
+                    raise ValueError('{} has an unknown record kind {} at offset {}'.format(path, kind, offset - 1))
+        except IndexError:
+            raise ValueError('{} is truncated or corrupt'.format(path))
+        if tick is not None:
+            yield tick
+
+    return config, ticks()
+
+
+class TraceChecker(TraceRecorder):
+    def __init__(self):
+        '''
+        decisions: records of the last completed tick
+
+        Collects the decisions of the replayed ticks instead of writing them
+        '''
+        self.command = None
+        self.events = []
+        self.locks = defaultdict(list)
+        self.decisions = []
+
+    def event(self, event, fields):
+        '''
+        Keeps the canonical text of the event, to be compared with the decoded events of the trace
+        '''
+        if event not in UNTRACED_EVENTS:
+            self.events.append(canonicalEvent(event, fields))
+
+    def endTick(self):
+        self.decisions = tickDecisions(self.command, self.events, self.locks)
+
+    def close(self):
+        pass
+
+
+def replayTrace(path, workers=0):
+    '''
+    path: trace file written by a TraceRecorder
+    workers: number of worker threads running the sites during the replay
+
+    Processes the commands of the trace without output in an engine with the recorded configuration and compares
+    the decisions of every tick with the recorded ones. Stops at the first divergence
+
+    Returns (number of ticks replayed, elapsed time, divergence). divergence is None if the replay matched the
+    trace, otherwise (tick number, command, recorded records, replayed records) of the first tick that differs
+    '''
+
+    # Imported here since the TransactionManager imports this module
+    from TransactionManager import TransactionManager
+
+    config, ticks = readTrace(path)
+    layout = Layout(config['sites'], config['variables'], config['placement'], config['replicationFactor'])
+    checker = TraceChecker()
+    tm = TransactionManager(layout, NullEventSink(), Stats() if config.get('stats') else None,
+                            catchUp=config['catchUp'], workers=workers,
+                            prevention=config['prevention'], quorum=config['quorum'],
+                            replicaPolicy=config['replicaPolicy'], trace=checker,
+                            escalation=config.get('escalation'))
+
+    count = 0
+    divergence = None
+    start = time.perf_counter()
+    try:
+        for tick in ticks:
+            count = count + 1
+            command = tick[0][1]
+            checker.decisions = []
+            try:
+                tm.processLine(command)
+            except (IndexError, ValueError, KeyError):
+                # The command was recorded, so it completed when recording. The replayed engine failed on it
+                pass
+            if checker.decisions != tick:
+                divergence = (count, command, tick, checker.decisions)
+                break
+    finally:
+        elapsed = time.perf_counter() - start
+        tm.close()
+
+    return count, elapsed, divergence
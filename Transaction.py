@@ -1,21 +1,22 @@
 
 class Transaction:
-    def __init__(self, time, id, ro, dbSnapshot = None):
+    def __init__(self, time, id, ro):
         '''
         timestamp: time when the transaction began
         trans_id: transaction id
         isReadOnly: indicated if the transaction is readonly or not
         willCommit: Indicates if the transaction can commit when end() is called. Aborts if willCommit is false
         accessedSites: set of the sites accessed by the transaction 
-        dbSnapshot: Dictionary of the variables at the time the transaction started. Used only for read only transactions.
-                    key is the variable id and values are the values of the variable read at the time transaction began
+        readCache: Dictionary with variable name as key and (value, site ids) as value. The value was read or written
+                   by the transaction under a lock it holds at those sites. Entries of a site are dropped when it fails
+                   and the cache goes away with the transaction when it commits or aborts
         '''
         self.timestamp = time 
         self.trans_id = id 
         self.isReadOnly = ro
         self.willCommit = True
         self.accessedSites = set()
-        self.dbSnapshot = dbSnapshot
+        self.readCache = {}
 
     def getStartTime(self):
         return self.timestamp
@@ -33,4 +34,11 @@ class Transaction:
         '''
         Adds a site to the accessedSites list
         '''
-        self.accessedSites.add(site)
\ No newline at end of file
+        self.accessedSites.add(site)
+
+    def forgetSite(self, site):
+        '''
+        Drops the cached values read or written at the site, since the transaction lost its locks there
+        '''
+        for var in [var for var, (val, sites) in self.readCache.items() if site in sites]:
+            del self.readCache[var]
\ No newline at end of file
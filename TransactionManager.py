@@ -1,9 +1,20 @@
 import re
 import sys
+import time
 from Transaction import Transaction
 from DataManager import DataManager
+from WaitsForGraph import WaitsForGraph
+from Layout import Layout
+from EventSink import EventSink
+from Trace import TraceSink
+from SitePool import SitePool
+from DeadlockPrevention import DeadlockPrevention
+from ReplicaSelection import REPLICA_POLICIES
 from collections import defaultdict
 
+# Pattern used to split a command into its name and arguments
+TOKEN_PATTERN = re.compile(r"[\w']+")
+
 class Operation:
     def __init__(self, cmd, trans_id, var, val=0):
         '''
@@ -12,6 +23,8 @@ class Operation:
         var: variable for which the R or W operation is requested
         val: The value with which variable is updated in case of write operation. (not used in case of read operation)
         isNew: Indicates if the operation is newly created or not
+        seq: position of the operation in the order in which operations were issued. Set by the transaction manager
+        batch: list of the write operations issued by the same MW command, None for single operations
         '''
 
         self.cmd = cmd
@@ -19,27 +32,229 @@ class Operation:
         self.var = var
         self.val = val
         self.isNew = True
+        self.seq = 0
+        self.batch = None
 
     def __repr__(self):
         return '(' + self.cmd + ',' + self.trans_id + "," + self.var + ',' + str(self.val) + ')'
 
+class Snapshot:
+    def __init__(self, epoch):
+        '''
+        epoch: number of commits, failures and recoveries before the snapshot was taken
+        values: Dictionary with variable name as key and the (found, value) read by the read-only transactions as
+                value. Filled on the first read of every variable, so the variables nobody reads are never copied
+
+        The committed state seen by the read-only transactions that began in the same epoch. They share the snapshot
+        '''
+
+        self.epoch = epoch
+        self.values = {}
+
 class TransactionManager:
-    def __init__(self):
+    def __init__(self, layout=None, sink=None, stats=None, logGroup=None, catchUp=False, workers=0, prevention=None, quorum=None,
+                 replicaPolicy='first', dumpSink=None, trace=None, escalation=None):
         '''
+        layout: Layout giving the number of sites, number of variables and their placement. Uses the default
+                layout of 10 sites and 20 variables if None
+        sink: EventSink to which the outcomes are emitted. Uses the human readable EventSink if None
+        stats: Stats recording the time of every phase and counters. Nothing is recorded if None
+        logGroup: LogGroup holding the write-ahead logs and checkpoints of the sites. If given, the state of the
+                  sites is restored from it and the logs are synced at the end of every tick
+        catchUp: Indicates if a recovering site copies the values committed while it was down from an up replica
+                 so that its replicated variables become readable right away
+        workers: number of worker threads running the sites. With 0 the sites are called one after another.
+                 Otherwise commit, abort, lock and write requests, dumps, the waits-for graph update and the log syncs
+                 are sent to all the sites at once through the sitePool, and the results are gathered in site order
+        sitePool: SitePool of the workers, None if workers is 0
+        prevention: deadlock prevention policy, wait-die or wound-wait. The sites check every lock request against
+                    the start times of the transactions it would wait for and the victims are aborted after the
+                    operations of the tick. Deadlocks are detected with the waits-for graph if None
+        quorum: (read quorum, write quorum) sizes. A write locks and updates only the first write quorum up replicas
+                of the variable and a read locks the first read quorum up replicas and returns the value with the
+                latest commit time. Every up replica is written (available copies) if None
+        readQuorum: read quorum size, None without quorums
+        writeQuorum: write quorum size, None without quorums
+        replicaPolicy: name of the policy ordering the up sites tried by a read of a replicated variable.
+                       first: in the order of site id, round-robin: starting at the next site on every new read,
+                       least-loaded: fewest pending lock requests first, sticky: sites accessed by the transaction first
+        replicaSelector: object of the replica selection policy
+        dumpSink: EventSink to which the dumps are emitted, for example one writing to a file. Uses sink if None
+        trace: TraceRecorder to which every processed command and the decisions of its tick are recorded: the
+               emitted events and the lock grants and waits at the sites. Nothing is recorded if None
+        escalation: number of variable locks of a transaction at a site above which they are escalated to a lock on
+                    the whole site, S if the transaction only read at the site and X otherwise. The transactions
+                    then take IS or IX locks on a site before locking its variables. Only variables are locked if None
         transactionQueue: dictionary of transactions with transaction id as key and transaction object as value
         timestamp: variable to store and increment time
-        operationQueue: Array of pending read and write operations. Has operation objects as elements 
-        dataManagers: Array of 10 data manages for 10 sites. Has DataManager objects as elements
-
-        The init method takes care of initializing the dataManagers array
+        operationQueue: Dictionary of pending read and write operations with the operation seq as key and the
+                        operation object as value, in the order the operations were issued
+        readyOps: Dictionary of operations (seq as key) to be tried in the next executeOperations() call
+        waitingOps: Dictionary with variable name as key and dictionary of blocked operations (seq as key) on that
+                    variable as value. They are tried again only when the variable changes at some site
+        transOps: Dictionary with transaction id as key and dictionary of its pending operations (seq as key) as value
+        opCount: number of operations issued so far, used to give each operation its seq
+        changedVars: set of variables whose locks, readability or availability changed since the last
+                     executeOperations() call. Filled by the data managers
+        dataManagers: Array of data managers, one per site. Has DataManager objects as elements
+        waitsForGraph: waits-for graph shared by the data managers and maintained as locks change
+        epoch: number of commits, failures and recoveries so far. The committed state can only change when it grows
+        snapshot: Snapshot of the last read only transaction that began
+        readOnlySnapshots: dictionary of the active read only transactions with transaction id as key and their
+                           Snapshot as value
+        readOnlyStarts: dictionary of the active read only transactions with transaction id as key and start time as
+                        value, in the order they began
+        varSites: catalog with variable name as key and list of ids of the sites holding the variable as value.
+                  A variable is added when it is first used, see getVarSites
+        siteUp: Array indexed by site id indicating if the site is up. Kept updated by fail and recover
+        layout: Layout of the sites and variables
+        instructions: dispatch table with the command name as key and the method handling it as value
+
+        The init method takes care of initializing the dataManagers array and the variable catalog
         '''
         self.transactionQueue = {}
         self.timestamp = 0
-        self.operationQueue = []
+        self.operationQueue = {}
+        self.readyOps = {}
+        self.waitingOps = defaultdict(dict)
+        self.transOps = defaultdict(dict)
+        self.opCount = 0
+        self.changedVars = set()
         self.dataManagers = []
+        self.waitsForGraph = WaitsForGraph()
+        self.readOnlyStarts = {}
+        self.epoch = 0
+        self.snapshot = None
+        self.readOnlySnapshots = {}
+
+        self.varSites = {}
+        self.siteUp = [False]
+        self.layout = layout if layout else Layout()
+        self.sink = sink if sink else EventSink()
+        self.trace = trace
+        if trace:
+            self.sink = TraceSink(self.sink, trace)
+            dumpSink = TraceSink(dumpSink, trace) if dumpSink else None
+        self.dumpSink = dumpSink if dumpSink else self.sink
+        self.stats = stats
+        self.logGroup = logGroup
+        self.catchUp = catchUp
+        self.sitePool = None
+        self.prevention = DeadlockPrevention(prevention, self.transactionQueue) if prevention else None
+        self.readQuorum, self.writeQuorum = quorum if quorum else (None, None)
+        if replicaPolicy not in REPLICA_POLICIES:
+            raise ValueError('Unknown replica selection policy {}'.format(replicaPolicy))
+        self.replicaSelector = REPLICA_POLICIES[replicaPolicy]()
+        self.instructions = {
+            'begin': self.beginTransaction,
+            'beginRO': self.beginReadOnly,
+            'W': self.queueWrite,
+            'R': self.queueRead,
+            'MW': self.queueMultiWrite,
+            'MR': self.queueMultiRead,
+            'dump': self.dumpSites,
+            'end': self.endTransaction,
+            'fail': self.failSite,
+            'recover': self.recoverSite,
+            'stats': self.showStats,
+            'checkpoint': self.checkpointSites,
+        }
+
+        if quorum:
+            self.checkQuorum()
+
+        for i in range(1, self.layout.numSites + 1):
+            wal = self.logGroup.getLog(i) if self.logGroup else None
+            self.dataManagers.append(DataManager(i, self.waitsForGraph, self.changedVars, self.layout, self.sink, self.stats, wal,
+                                                 self.prevention, quorum is not None, trace, escalation))
+            self.siteUp.append(True)
+
+        if self.logGroup:
+            self.restore()
+
+        if workers:
+            self.sitePool = SitePool(self.dataManagers, workers)
+
+    def restore(self):
+        '''
+        Restores the state of every site from its checkpoint and log.
+        The time continues after the latest logged timestamp so that new commits are stamped after the restored ones
+        '''
+
+        lastTs = -1
+        for dm in self.dataManagers:
+            lastTs = max(lastTs, dm.restore())
+            self.siteUp[dm.siteId] = dm.isUp
+        self.timestamp = lastTs + 1
+
+    def getVarSites(self, var):
+        '''
+        var: variable name
+
+        Returns the list of ids of the sites holding the variable, in the order of site id. Empty if there is no such
+        variable. The sites are looked up in the layout on the first use of the variable
+        '''
+
+        sites = self.varSites.get(var)
+        if sites is None:
+            sites = self.varSites[var] = self.layout.getVariableSites(var)
+        return sites
+
+    def getUpSites(self, var):
+        '''
+        var: variable name
+
+        Returns the list of data managers of the sites that are up and hold the variable, in the order of site id
+        '''
+        return [self.dataManagers[siteId-1] for siteId in self.getVarSites(var) if self.siteUp[siteId]]
+
+    def checkQuorum(self):
+        '''
+        Raises a ValueError if the quorum sizes cannot guarantee that a read sees the latest committed write,
+        that is if they do not satisfy R+W > N and 2W > N for the N replicas of a replicated variable
+        '''
+
+        n = self.layout.replicationFactor
+        r, w = self.readQuorum, self.writeQuorum
+        if not (1 <= r <= n and 1 <= w <= n and r + w > n and 2*w > n):
+            raise ValueError('Invalid quorum: read {} and write {} for {} replicas, R+W and 2W must exceed the replicas'.format(r, w, n))
+
+    def getQuorum(self, var, size):
+        '''
+        var: variable name
+        size: quorum size
+
+        Returns the data managers of the first size up sites holding the variable, in the order of site id.
+        A variable at fewer sites needs all of them. Returns an empty list if not enough sites are up
+        '''
+
+        need = min(size, len(self.getVarSites(var)))
+        upSites = self.getUpSites(var)
+        if len(upSites) < need:
+            return []
+        return upSites[:need]
+
+    def callSites(self, dataManagers, method, *args):
+        '''
+        dataManagers: data managers to be called
+        method: name of the DataManager method
+        args: arguments of the method
+
+        Calls the method on every data manager, through the sitePool if there is one, and returns the results
+        in the order of dataManagers
+        '''
+
+        if self.sitePool:
+            return self.sitePool.call(dataManagers, method, *args)
+        return [getattr(dm, method)(*args) for dm in dataManagers]
 
-        for i in range(1,11):
-            self.dataManagers.append(DataManager(i))
+    def close(self):
+        '''
+        Stops the workers of the sites
+        '''
+
+        if self.sitePool:
+            self.sitePool.close()
 
     def processLine(self, command):
         '''
@@ -54,153 +269,482 @@ class TransactionManager:
         # print(command)
         if command[0]=='/': 
             return 
-            
-        tokens = re.findall(r"[\w']+",command)
+
+        tokens = TOKEN_PATTERN.findall(command)
+
+        if self.trace:
+            self.trace.beginTick(tokens)
 
         # print('tokens:',tokens)      
 
+        if self.stats:
+            self.processTimed(tokens)
+        else:
+            self.processInstruction(tokens[0],tokens[1:])
+            self.executeOperations()
+            if self.resolveDeadlock():
+                self.executeOperations()
+
+        if self.logGroup:
+            self.logGroup.endTick(self.dataManagers, self.sitePool)
+
+        self.timestamp = self.timestamp + 1
+
+        if self.trace:
+            self.trace.endTick()
+
+        # print('\n Remaining operatins: ',list(self.operationQueue.values()))
+
+    def processTimed(self, tokens):
+        '''
+        tokens: command name followed by its arguments
+
+        Same as the body of processLine() but records the wall time of every phase in the stats
+        '''
+
+        perfCounter = time.perf_counter
+        start = perfCounter()
         self.processInstruction(tokens[0],tokens[1:])
+        instructionEnd = perfCounter()
         self.executeOperations()
-        if self.resolveDeadlock():
+        executeEnd = perfCounter()
+        hasDeadlock = self.resolveDeadlock()
+        deadlockEnd = perfCounter()
+
+        self.stats.addTime('processInstruction', instructionEnd - start)
+        self.stats.addTime('executeOperations', executeEnd - instructionEnd)
+        self.stats.addTime('resolveDeadlock', deadlockEnd - executeEnd)
+
+        if hasDeadlock:
             self.executeOperations()
+            self.stats.addTime('executeOperations', perfCounter() - deadlockEnd)
 
-        self.timestamp = self.timestamp + 1
+    def processLines(self, lines):
+        '''
+        lines: iterable of commands, for example an open file
+
+        Processes the commands one after another. Used by the batch mode to stream large command files
+        '''
 
-        # print('\n Remaining operatins: ',self.operationQueue)
+        processLine = self.processLine
+        for command in lines:
+            processLine(command)
         
     def processInstruction(self, cmd, args):
         '''
         cmd: command to be executed 
         args: array of arguments required to execute the command.
 
-        begin, beginRO, dump, fail, and recover operations are executed within the function itself.
-        beginRO uses a snapshot function to read the values of variable in the database at the beginning of transaction
+        The method looks up the handler of the command in the instructions dispatch table and calls it.
+        begin, beginRO, dump, end, fail, and recover operations are executed by their handlers.
         R and W commands are added to the operationQueue which will be executed afterwards using the executeOperations() function.
         '''
 
-        if cmd == 'begin':
-            # Check if transaction id is valid and add corresponsing transaction object to the 
-            # transaction queue 
+        handler = self.instructions.get(cmd)
+        if handler:
+            handler(args)
+        else:
+            self.sink.emit('invalid')
 
-            if(args[0] in self.transactionQueue.keys()):
-                print("transaction id {} already present", args[0])
-            else:
-                self.transactionQueue[args[0]] = Transaction(self.timestamp, args[0], False)
-                print("{} begins".format(args[0]))
+    def beginTransaction(self, args):
+        '''
+        args: [transaction id]
 
-        elif cmd == 'beginRO':
-            # Check if transaction id is valid and read the database snapshot and add corresponsing
-            # transaction object to the transaction queue 
+        Check if transaction id is valid and add corresponsing transaction object to the transaction queue 
+        '''
+
+        if(args[0] in self.transactionQueue.keys()):
+            self.sink.emit('duplicate', trans_id=args[0])
+        else:
+            self.transactionQueue[args[0]] = Transaction(self.timestamp, args[0], False)
+            self.sink.emit('begin', trans_id=args[0])
+
+    def beginReadOnly(self, args):
+        '''
+        args: [transaction id]
+
+        Check if transaction id is valid and add corresponsing transaction object to the transaction queue 
+        The transaction reads the versions committed before its start time, so no snapshot is copied
+        '''
 
-            if(args[0] in self.transactionQueue.keys()):
-                print("transaction id {} already present", args[0])
+        if(args[0] in self.transactionQueue.keys()):
+            self.sink.emit('duplicate', trans_id=args[0])
+        else:
+            self.transactionQueue[args[0]] = Transaction(self.timestamp, args[0], True)
+            self.readOnlyStarts[args[0]] = self.timestamp
+
+            # Nothing changed since the last snapshot was taken, so the transaction shares it
+            if self.snapshot and self.snapshot.epoch == self.epoch:
+                if self.stats:
+                    self.stats.count('snapshots shared')
             else:
-                varList = self.readSnapshot()
-                self.transactionQueue[args[0]] = Transaction(self.timestamp, args[0], True, varList)
-                print("{} begins and is read-only".format(args[0]))
-
-        elif cmd == 'W':
-             # Insert a Write Operation to the operation queue.
-
-            trans_id = args[0]
-            var = args[1]
-            val = args[2]
-            if(trans_id in self.transactionQueue.keys()):
-                self.operationQueue.append(Operation("W", trans_id, var, val))
+                self.snapshot = Snapshot(self.epoch)
+            self.readOnlySnapshots[args[0]] = self.snapshot
+            self.sink.emit('beginRO', trans_id=args[0])
+
+    def queueWrite(self, args):
+        '''
+        args: [transaction id, variable, value]
+
+        Insert a Write Operation to the operation queue.
+        '''
+
+        trans_id = args[0]
+        var = args[1]
+        val = args[2]
+        if(trans_id in self.transactionQueue.keys()):
+            self.addOperation(Operation("W", trans_id, var, val))
+        else:
+            self.sink.emit('notFound', trans_id=trans_id)
+
+    def queueRead(self, args):
+        '''
+        args: [transaction id, variable]
+
+        Insert a Read Operation to the operation queue.
+        '''
+
+        trans_id = args[0]
+        var = args[1]
+        if(trans_id in self.transactionQueue.keys()):
+            self.addOperation(Operation("R", trans_id, var))
+        else:
+            self.sink.emit('notFound', trans_id=trans_id)
+
+    def queueMultiWrite(self, args):
+        '''
+        args: [transaction id, variable, value, variable, value, ...]
+
+        Insert a Write Operation for every variable to the operation queue. MW(T1, x2=5, x4=7) is split into
+        [T1, x2, 5, x4, 7]. The operations form a batch whose locks are requested with one call per site
+        '''
+
+        if len(args) < 3 or len(args) % 2 == 0:
+            self.sink.emit('invalid')
+            return
+
+        trans_id = args[0]
+        if(trans_id in self.transactionQueue.keys()):
+            batch = []
+            for i in range(1, len(args), 2):
+                operation = Operation("W", trans_id, args[i], args[i+1])
+                operation.batch = batch
+                batch.append(operation)
+                self.addOperation(operation)
+        else:
+            self.sink.emit('notFound', trans_id=trans_id)
+
+    def queueMultiRead(self, args):
+        '''
+        args: [transaction id, variable, variable, ...]
+
+        Insert a Read Operation for every variable to the operation queue. The reads are done as if they were issued
+        by separate R commands in the same tick, since every read stops at the first site that gives a value
+        '''
+
+        if len(args) < 2:
+            self.sink.emit('invalid')
+            return
+
+        trans_id = args[0]
+        if(trans_id in self.transactionQueue.keys()):
+            for var in args[1:]:
+                self.addOperation(Operation("R", trans_id, var))
+        else:
+            self.sink.emit('notFound', trans_id=trans_id)
+
+    def dumpSites(self, args):
+        '''
+        args: any of changed, site ids and variable names
+
+        Emits the committed values of the variables at every site, one dump event per site in the order of site id.
+        With site ids only those sites are dumped, and with variable names only those variables at the sites holding
+        them. With changed only the variables committed since they were last dumped at the site are dumped, and the
+        sites without such variables are left out
+        '''
+
+        changedOnly = False
+        siteIds = []
+        varList = []
+        for arg in args:
+            if arg == 'changed':
+                changedOnly = True
+            elif arg.isdigit() and 1 <= int(arg) <= len(self.dataManagers):
+                siteIds.append(int(arg))
+            elif self.getVarSites(arg):
+                varList.append(arg)
             else:
-                print("Transaction {} not found".format(trans_id))
+                self.sink.emit('invalid')
+                return
+
+        dataManagers = [self.dataManagers[siteId-1] for siteId in sorted(set(siteIds))] if siteIds else self.dataManagers
+        if varList:
+            dataManagers = [dm for dm in dataManagers if any(var in dm.variableList for var in varList)]
+
+        dumped = False
+        for dm, values in zip(dataManagers, self.callSites(dataManagers, 'dump', varList if varList else None, changedOnly)):
+            if values or not changedOnly:
+                self.dumpSink.emit('dump', site=dm.siteId, values=values)
+                dumped = True
+
+        if changedOnly and not dumped:
+            self.dumpSink.emit('dumpUnchanged')
+
+    def endTransaction(self, args):
+        '''
+        args: [transaction id]
+
+        Check if the transacton can commit or has to abort and take appropriate action
+        '''
 
-        elif cmd == 'R':
-            #  Insert a Read Operation to the operation queue.
+        trans_id = args[0]
 
-            trans_id = args[0]
-            var = args[1]
-            if(trans_id in self.transactionQueue.keys()):
-                self.operationQueue.append(Operation("R", trans_id, var))
+        if(trans_id in self.transactionQueue.keys()):
+            if (self.transactionQueue[trans_id]).canCommit:
+                self.commit(trans_id, self.timestamp)
             else:
-                print("Transaction {} not found".format(trans_id))
+                self.abort(trans_id, True)
+        else:
+            self.sink.emit('notFound', trans_id=trans_id)
+
+    def failSite(self, args):
+        '''
+        args: [site id]
+
+        Call the fail method in the corresponding data manager 
+        change the can commit state of the transaction that has accessed that site to false
+        '''
+
+        siteId = int(args[0])
+        dm = self.dataManagers[siteId-1]
+        dm.fail(self.timestamp, self.getVersionHorizon())
+        self.siteUp[siteId] = False
+        self.epoch = self.epoch + 1
+        self.sink.emit('fail', site=siteId)
+
+        for transaction in self.transactionQueue.values():
+            if (not transaction.isReadOnly) and (transaction.canCommit) and (siteId in transaction.accessedSites):
+                transaction.canCommit = False
+            # The locks of the cached values read or written at the site are gone
+            if siteId in transaction.accessedSites:
+                transaction.forgetSite(siteId)
+
+    def recoverSite(self, args):
+        '''
+        args: [site id]
 
-        elif cmd == 'dump':
-            # loop through dataManagers and perform dump() on each of them
+        Call the recover method in the corresponding data manager 
+        '''
+
+        siteId = int(args[0])
+        dm = self.dataManagers[siteId-1]
+        dm.recover(self.timestamp, self.getVersionHorizon())
+        self.siteUp[siteId] = True
+        self.epoch = self.epoch + 1
 
-            for dm in self.dataManagers:
-                dm.dump()
+        self.sink.emit('recover', site=siteId)
 
-        elif cmd == 'end':
-            # Check if the transacton can commit or has to abort and take appropriate action
+        if self.catchUp:
+            self.catchUpSite(dm)
 
-            trans_id = args[0]
+    def catchUpSite(self, dm):
+        '''
+        dm: data manager of the site that recovered
 
-            if(trans_id in self.transactionQueue.keys()):
-                if (self.transactionQueue[trans_id]).canCommit:
-                    self.commit(trans_id, self.timestamp)
+        Makes the replicated variables of the site readable by comparing their lastWrite with the one of a readable
+        replica at an up site. Only the variables written while the site was down are copied and logged, the others
+        are only made readable.
+        A variable write-locked at an up replica stays unreadable, since the transaction holding the lock will not
+        commit its value at this site
+        '''
+
+        horizon = self.getVersionHorizon()
+        transferred = 0
+        readable = 0
+
+        # The committed states are compared without creating the variables at the site and its peers
+        for varId in dm.varOrder:
+            if not self.layout.isReplicated(int(varId[1:])):
+                continue
+            value, lastWrite, isReadable = dm.getCommittedState(varId)
+            if isReadable:
+                continue
+
+            source = None
+            for peer in self.getUpSites(varId):
+                if peer is dm:
+                    continue
+                if peer.isWriteLocked(varId):
+                    source = None
+                    break
+                if not source:
+                    state = peer.getCommittedState(varId)
+                    if state[2]:
+                        source = state
+
+            if source:
+                if source[1] > lastWrite:
+                    transferred = transferred + 1
+                    dm.catchUp(varId, source[0], source[1], self.timestamp, horizon)
                 else:
-                    self.abort(trans_id, True)
-            else:
-                print("Transaction {} not found".format(trans_id))
+                    dm.markReadable(varId, self.timestamp, horizon)
+                readable = readable + 1
 
-        elif cmd == 'fail':
-            # Call the fail method in the corresponding data manager 
-            # change the can commit state of the transaction that has accessed that site to false
+        if self.stats:
+            self.stats.count('catch-up transfers', transferred)
+        self.sink.emit('catchUp', site=dm.siteId, readable=readable, transferred=transferred)
 
-            siteId = int(args[0])
-            dm = self.dataManagers[siteId-1]
-            dm.fail()
-            print("site {} fails".format(siteId))
+    
+    def checkpointSites(self, args):
+        '''
+        args: not used
 
-            for transaction in self.transactionQueue.values():
-                if (not transaction.isReadOnly) and (transaction.canCommit) and (siteId in transaction.accessedSites):
-                    transaction.canCommit = False
+        Writes the checkpoint of every site, whether it changed or not, and empties the logs
+        '''
 
-        elif cmd == 'recover':
-            # Call the recover method in the corresponding data manager 
+        if self.logGroup:
+            self.logGroup.checkpointAll(self.dataManagers, self.sitePool)
+            self.sink.emit('checkpoint', sites=len(self.dataManagers))
+        else:
+            self.sink.emit('checkpointDisabled')
 
-            siteId = int(args[0])
-            dm = self.dataManagers[siteId-1]
-            dm.recover(self.timestamp)
-            print("site {} recovers".format(siteId))
+    def showStats(self, args):
+        '''
+        args: not used
 
+        Emits the phase times and counters collected so far
+        '''
+
+        if self.stats:
+            self.sink.emit('stats', **self.stats.summary())
         else:
-            print("Invalid operation")
+            self.sink.emit('statsDisabled')
 
-    
-    def readSnapshot(self):
+    def readVersion(self, var, ts):
         '''
-        Reads the snapshot of the database using available the data managers for read only transactions
-        The method calls the readSnapshot method of datamanager that returns the dictionary of variables.
+        var: variable name
+        ts: start time of the read-only transaction
 
-        varList: dictionary containing the key values as variable name and values as their value
+        Reads the variable as it was when a read only transaction began, using the versions kept by the data managers.
+        The value is taken from the last site in order that was up and could read the variable at that time.
+
+        Returns a tuple (found, value)
+        With quorums the versions of a read quorum of up replicas are compared and the latest one is returned
         '''
-        
-        varList = {}
-        for dm in self.dataManagers:
-            if dm.isUp:
-                tempList = dm.readSnapshot()
 
-                for var in tempList.keys():
-                    varList[var] = tempList[var]
+        if self.readQuorum:
+            versions = [dm.getVersion(var, ts) for dm in self.getQuorum(var, self.readQuorum)]
+            if not versions:
+                return (False, None)
+            return (True, max(versions, key=lambda version: version[0])[1])
+
+        for siteId in reversed(self.getVarSites(var)):
+            found, val = self.dataManagers[siteId-1].readVersion(var, ts)
+            if found:
+                return (True, val)
+
+        # print("version read is: ", var, val)
+
+        return (False, None)
 
-        # print("snapshot read is: ", varList)
-             
-        return varList
+    def readSnapshot(self, trans_id, var):
+        '''
+        trans_id: transaction id of the read only transaction
+        var: variable name
+
+        Returns the (found, value) of the variable in the snapshot of the transaction. The version is read on the
+        first read of the variable by any transaction sharing the snapshot. With quorums a version that was not
+        found is not kept, since the read depends on the sites that are up
+        '''
+
+        values = self.readOnlySnapshots[trans_id].values
+        if var in values:
+            if self.stats:
+                self.stats.count('snapshot reads shared')
+            return values[var]
+
+        found, value = self.readVersion(var, self.transactionQueue[trans_id].timestamp)
+        # With quorums a read fails while too few replicas are up, it is tried again once sites recover
+        if found or not self.readQuorum:
+            values[var] = (found, value)
+        return (found, value)
+
+    def getVersionHorizon(self):
+        '''
+        Returns the start time of the oldest active read only transaction, or None if there is none.
+        Versions committed before the latest version older than this time can be discarded
+        '''
+
+        for ts in self.readOnlyStarts.values():
+            return ts
+        return None
  
 
  ####### EXECUTE OPERATIONS IN THE QUEUE ###############
  
 
+    def addOperation(self, operation):
+        '''
+        operation: read or write operation issued by a transaction
+
+        Gives the operation its seq and adds it to the operation queue. It is tried in the next executeOperations() call
+        '''
+
+        self.opCount = self.opCount + 1
+        operation.seq = self.opCount
+        self.operationQueue[operation.seq] = operation
+        self.readyOps[operation.seq] = operation
+        self.transOps[operation.trans_id][operation.seq] = operation
+
+    def removeOperation(self, operation):
+        '''
+        operation: operation to be removed
+
+        Removes the operation from the operation queue and from the ready or waiting lists holding it
+        '''
+
+        self.operationQueue.pop(operation.seq, None)
+        self.readyOps.pop(operation.seq, None)
+
+        waiting = self.waitingOps.get(operation.var)
+        if waiting is not None:
+            waiting.pop(operation.seq, None)
+            if not waiting:
+                del self.waitingOps[operation.var]
+
+        ops = self.transOps.get(operation.trans_id)
+        if ops is not None:
+            ops.pop(operation.seq, None)
+            if not ops:
+                del self.transOps[operation.trans_id]
+
     def executeOperations(self):
         '''
-        The method loops through the operation queue and executes the operations that can be executed.
-        It keeps track of the executed operations and removes them from the queue at the end
+        The method executes the operations that can be executed, in the order in which they were issued.
+        Only the new operations, the read-only reads and the operations waiting on a variable that changed since the
+            last call are tried. A blocked operation is parked on its variable until the variable changes again
         Changes the isNew status of operation to false to indicate that it has been processed once.
             This restrains the data manager to add the same lock request multiple times in the pending queue
         '''
-       
-        removeOperations = []
-        for operation in self.operationQueue:
+
+        # Wake up the operations waiting on the variables that changed
+        for var in self.changedVars:
+            if var in self.waitingOps:
+                self.readyOps.update(self.waitingOps.pop(var))
+        self.changedVars.clear()
+
+        readyOps = self.readyOps
+        self.readyOps = {}
+        batchResults = {}
+
+        for seq in sorted(readyOps.keys()):
+            operation = readyOps[seq]
             trans_id = operation.trans_id
             var = operation.var
             isNewOp = operation.isNew
+            if self.stats:
+                self.stats.count('operations executed' if isNewOp else 'operations retried')
+            retryAlways = False
 
             if trans_id in self.transactionQueue.keys():
                 success = False
@@ -211,38 +755,44 @@ class TransactionManager:
                     # check if the transaction is readonly
                     if self.transactionQueue[trans_id].isReadOnly:
 
-                        # take the transaction from the transaction queue which contains the variable 
-                        # information from the snapshot taken at the begin time
-                        transaction = self.transactionQueue[trans_id]
+                        # read the version of the variable committed before the transaction began
+                        found, val = self.readSnapshot(trans_id, var)
 
-                        # Check if the variable exists in the snapshot and complete the operation if it does
-                        if var in transaction.dbSnapshot.keys():
+                        # Check if the variable could be read at the begin time and complete the operation if it could
+                        if found:
                             success = True
-                            print("{}: {}".format(var, self.transactionQueue[trans_id].dbSnapshot[var]))
+                            self.sink.emit('readOnlyRead', trans_id=trans_id, var=var, value=val)
                         else:
+                            # The snapshot does not change, the read is reported again on every call
                             success = False
-                            print("var not found")
+                            retryAlways = True
+                            self.sink.emit('readOnlyMissing', trans_id=trans_id, var=var)
                     else:
                         # If transaction is not read only, call the read method to perfrom the read operation
                         success = self.read(trans_id, var, isNewOp)
+                elif operation.batch and isNewOp and not self.writeQuorum:
+                    # The first write of a new MW batch requests the locks of the whole batch
+                    if seq not in batchResults:
+                        batchResults.update(self.writeBatch(trans_id, operation.batch))
+                    success = batchResults.pop(seq)
                 else:
                     # operation has to perform write
                     val = operation.val 
                     success = self.write(trans_id, var, val, isNewOp)
-
-                # If the operation was executed successfully add it to the remove queue
-                if success:
-                    removeOperations.append(operation)
             else:
-                # If the transaction id does not exist in the transactionQueue, add the operation to the remove queue
-                removeOperations.append(operation)
-            
+                # If the transaction id does not exist in the transactionQueue, the operation is removed
+                success = True
+
             operation.isNew = False
-        # Remove all the operations in the remove queue from the operationQueue
-        for operation in removeOperations:
-            self.operationQueue.remove(operation)
 
-        # print("Remaining operations: ", self.operationQueue)
+            if success:
+                self.removeOperation(operation)
+            elif retryAlways:
+                self.readyOps[seq] = operation
+            else:
+                self.waitingOps[var][seq] = operation
+
+        # print("Remaining operations: ", list(self.operationQueue.values()))
 
 
 ########### READ - WRITE OPERATIONS ###############
@@ -260,23 +810,69 @@ class TransactionManager:
         if trans_id in self.transactionQueue.keys():
             ts = self.transactionQueue[trans_id].timestamp
 
-            for dm in self.dataManagers:
-                # if the data manager is available, check if it has the variable 
-                # if it has variable, read the value from the data manager 
-                if dm.isUp and dm.hasVariable(var):
-                    val = dm.read(trans_id, var, isNew)
+            if self.readQuorum:
+                return self.quorumRead(trans_id, var, isNew)
+
+            # read the value from the available data managers having the variable, in the order of the replica policy
+            transaction = self.transactionQueue[trans_id]
+            sites = self.replicaSelector.order(transaction, var, self.getUpSites(var), isNew)
+
+            # A reread is served from the cache when the first site tried is one where the transaction holds the
+            # lock of the cached value, since that site would return the same value without changing any lock.
+            # The variable must still be readable there, recover() on a site that is up makes it unreadable
+            cached = transaction.readCache.get(var)
+            if cached and sites and sites[0].siteId in cached[1] and sites[0].variableList[var].isReadable:
+                self.sink.emit('read', trans_id=trans_id, var=var, value=cached[0], site=sites[0].siteId)
+                if self.stats:
+                    self.stats.count('cached reads')
+                return True
+
+            for dm in sites:
+                val = dm.read(trans_id, var, isNew)
 
-                    if val:
-                        # If the read was successful update the accessed site for the transaction
-                        self.transactionQueue[trans_id].addSite(dm.siteId)
+                if val:
+                    # If the read was successful update the accessed site for the transaction
+                    self.transactionQueue[trans_id].addSite(dm.siteId)
+                    transaction.readCache[var] = (val, (dm.siteId,))
 
-                        # print("{} reads {}.{} = {}".format(trans_id, dm.siteId, var, val))
+                    # print("{} reads {}.{} = {}".format(trans_id, dm.siteId, var, val))
 
-                        print("{} reads {}: {}".format(trans_id, var, val))
-                        return True
+                    self.sink.emit('read', trans_id=trans_id, var=var, value=val, site=dm.siteId)
+                    return True
 
         return False
 
+    def quorumRead(self, trans_id, var, isNew):
+        '''
+        trans_id: transaction id
+        var: variable name for which the read is to be performed
+
+        Reads the variable at a read quorum of replicas. The read succeeds once all of them gave a read lock.
+        The value written by the transaction itself is returned if it has one, otherwise the value with the
+        latest commit time
+        '''
+
+        sites = self.getQuorum(var, self.readQuorum)
+        values = [dm.read(trans_id, var, isNew) for dm in sites]
+        if not sites or any(val is None for val in values):
+            return False
+
+        latest = None
+        for dm, val in zip(sites, values):
+            variable = dm.variableList[var]
+            if trans_id in variable.tempVal:
+                latest = (dm, val)
+                break
+            if latest is None or variable.lastWrite > latest[0].variableList[var].lastWrite:
+                latest = (dm, val)
+
+        # The transaction holds read locks at all the sites of the quorum
+        for dm in sites:
+            self.transactionQueue[trans_id].addSite(dm.siteId)
+
+        self.sink.emit('read', trans_id=trans_id, var=var, value=latest[1], site=latest[0].siteId)
+        return True
+
     def write(self, trans_id, var, val, isNew):
         '''
         trans_id: transaction id
@@ -291,39 +887,95 @@ class TransactionManager:
         if trans_id in self.transactionQueue.keys():
             ts = self.transactionQueue[trans_id].timestamp
 
-            # allSitesDown keeps track whether all sites are down or not 
+            # upSites are the available sites having the variable, or a write quorum of them.
+            # It is empty if all sites are down or not enough sites are up for a quorum
             # hasAllWriteLocks tracks whether we can get write lock on all the sites having the variable
-            allSitesDown = True
-            hasAllWriteLocks = True
-            # sites=[]
-            for dm in self.dataManagers:
-                
-                if dm.isUp and dm.hasVariable(var):
-                    allSitesDown = False
-                    gaveLock = dm.getWriteLock(trans_id, var, isNew)
-    
-                    if not gaveLock:
-                        hasAllWriteLocks = False
+            upSites = self.getQuorum(var, self.writeQuorum) if self.writeQuorum else self.getUpSites(var)
+            hasAllWriteLocks = all(self.callSites(upSites, 'getWriteLock', trans_id, var, isNew))
             
             # write only if all the available sites gives lock on the variable
-            if (not allSitesDown) and (hasAllWriteLocks):
+            if upSites and hasAllWriteLocks:
                 sitesModified = []
-                for dm in self.dataManagers:
-                    if dm.isUp and dm.hasVariable(var):
 
-                        # perform write operation in the data manager 
-                        # Update the sites accessed by the transaction
+                # perform write operation in the data managers
+                self.callSites(upSites, 'write', trans_id, var, val)
 
-                        dm.write(trans_id, var, val)
-                        self.transactionQueue[trans_id].addSite(dm.siteId)
-                        sitesModified.append(dm.getSiteId())
+                # Update the sites accessed by the transaction
+                for dm in upSites:
+                    self.transactionQueue[trans_id].addSite(dm.siteId)
+                    sitesModified.append(dm.getSiteId())
 
-                print("{} writes {} = {} to the sites: {}".format(trans_id, var, val, sitesModified))
+                self.cacheWrite(trans_id, var, val, upSites)
+                self.sink.emit('write', trans_id=trans_id, var=var, value=val, sites=sitesModified)
                 return True
 
         return False
 
 
+    def cacheWrite(self, trans_id, var, val, dataManagers):
+        '''
+        trans_id: transaction id
+        var: variable written
+        val: value written
+        dataManagers: data managers of the sites written, where the transaction holds the write lock
+
+        Caches the tentative value for the rereads of the transaction at the sites where the variable is readable.
+        A site that recovered does not serve reads of the variable before a commit, which the write lock prevents.
+        With quorums the reads compare the replicas, so nothing is cached. A value the reads would skip is not
+        cached either
+        '''
+
+        cache = self.transactionQueue[trans_id].readCache
+        sites = tuple(dm.siteId for dm in dataManagers if dm.variableList[var].isReadable)
+        if val and sites and not self.readQuorum:
+            cache[var] = (val, sites)
+        else:
+            cache.pop(var, None)
+
+    def writeBatch(self, trans_id, batch):
+        '''
+        trans_id: transaction id
+        batch: new write operations of a MW command
+
+        Requests the write locks of all the variables of the batch with one getWriteLocks() call per site and writes
+        the variables locked at all their up sites with one writeMany() call per site.
+        A variable is written only if all the up sites holding it gave the lock, as for a single write
+
+        Returns a dictionary with the seq of every operation as key and a boolean telling if it was written as value
+        '''
+
+        varList = list(dict.fromkeys(operation.var for operation in batch))
+        upSites = {var: self.getUpSites(var) for var in varList}
+        sites = sorted({dm.siteId: dm for var in varList for dm in upSites[var]}.items())
+        dataManagers = [dm for siteId, dm in sites]
+
+        # A variable is locked if it is up at some site and every up site holding it gave the lock
+        locked = {var: len(upSites[var]) > 0 for var in varList}
+        for grants in self.callSites(dataManagers, 'getWriteLocks', trans_id, varList, True):
+            for var, gaveLock in grants:
+                if not gaveLock:
+                    locked[var] = False
+
+        writes = [(operation.var, operation.val) for operation in batch if locked[operation.var]]
+        if writes:
+            writtenVars = {var for var, val in writes}
+            self.callSites([dm for dm in dataManagers if any(var in dm.variableList for var in writtenVars)],
+                           'writeMany', trans_id, writes)
+
+        results = {}
+        for operation in batch:
+            results[operation.seq] = locked[operation.var]
+            if locked[operation.var]:
+                sitesModified = []
+                for dm in upSites[operation.var]:
+                    self.transactionQueue[trans_id].addSite(dm.siteId)
+                    sitesModified.append(dm.getSiteId())
+                self.cacheWrite(trans_id, operation.var, operation.val, upSites[operation.var])
+                self.sink.emit('write', trans_id=trans_id, var=operation.var, value=operation.val, sites=sitesModified)
+
+        return results
+
+
 ########## END TRANSACTION OPERATIONS ###############
 
 
@@ -335,42 +987,57 @@ class TransactionManager:
         calls the commit in data managers so that appropriate actions can be taken at each site
         '''
 
-        for dm in self.dataManagers:
-            dm.commit(trans_id, time)
-
-        # Remove the transaction from the transacitonQueue
+        oldHorizon = self.getVersionHorizon()
+        self.readOnlyStarts.pop(trans_id, None)
+        self.readOnlySnapshots.pop(trans_id, None)
+        # A read only transaction can also have written, so every commit starts a new epoch
+        self.epoch = self.epoch + 1
+        horizon = self.getVersionHorizon()
+        self.callSites(self.dataManagers, 'commit', trans_id, time, horizon)
+        if horizon != oldHorizon:
+            self.callSites(self.dataManagers, 'pruneVersions', horizon)
+
+        # Remove the transaction from the transacitonQueue along with its pending operations
         self.transactionQueue.pop(trans_id)
-        print("{} commits".format(trans_id))
-
-    def abort(self, trans_id, hasSiteFailure=False):
+        self.replicaSelector.forget(trans_id)
+        for operation in list(self.transOps.get(trans_id, {}).values()):
+            self.removeOperation(operation)
+        self.sink.emit('commit', trans_id=trans_id)
+        if self.stats:
+            self.stats.count('commits')
+
+    def abort(self, trans_id, hasSiteFailure=False, cause=None):
         '''
         trans_id: transaction id
+        hasSiteFailure: Indicates if the transaction aborts because a site it accessed failed
+        cause: cause of the abort reported in the output. Decided by hasSiteFailure if None
 
         The method calls abort on data managers for the transaction to take appropriate actions 
         '''
 
-        for dm in self.dataManagers:
-            dm.abort(trans_id)
+        self.callSites(self.dataManagers, 'abort', trans_id)
 
         # Remove the transaction from the transactionQueue
         self.transactionQueue.pop(trans_id)
+        self.replicaSelector.forget(trans_id)
+        oldHorizon = self.getVersionHorizon()
+        self.readOnlyStarts.pop(trans_id, None)
+        self.readOnlySnapshots.pop(trans_id, None)
+        horizon = self.getVersionHorizon()
+        if horizon != oldHorizon:
+            self.callSites(self.dataManagers, 'pruneVersions', horizon)
         
-        # Check the operationQueue to find any pending operation for the transaction, add them to remove list
-        removeList = []
-        for operation in self.operationQueue:
-            if operation.trans_id == trans_id:
-                removeList.append(operation)
-
-        #  Remove the operations stored in the remove list
-        for operation in removeList:
-            self.operationQueue.remove(operation)
+        # Remove the pending operations of the transaction
+        for operation in list(self.transOps.get(trans_id, {}).values()):
+            self.removeOperation(operation)
 
         # print("{} aborts".format(trans_id))
 
-        if hasSiteFailure:
-            print("{} aborts due to site failure".format(trans_id))
-        else:
-            print("{} aborts due to deadlock".format(trans_id))
+        if cause is None:
+            cause = 'site failure' if hasSiteFailure else 'deadlock'
+        self.sink.emit('abort', trans_id=trans_id, cause=cause)
+        if self.stats:
+            self.stats.count('aborts: ' + cause)
 
     
 ############## DEADLOCK DETECTION ############
@@ -378,56 +1045,46 @@ class TransactionManager:
 
     def resolveDeadlock(self):
         '''
-        The method iterates over all data managers and gets the waits for graph from it.
-        It finds the youngest transaction
-
+        The method gets the transactions that are part of a cycle in the waits-for graph.
+        It finds the youngest transaction among them and aborts it
+        With a deadlock prevention policy no graph is built, the victims chosen by the sites are aborted instead
         '''
-        # Detect deadlocks using cycle detection and abort the youngest transaction in the cycle.
-        
-        graph = defaultdict(set)
 
-        # Create the graph by updating the conflict edges in the graph dictionary
-        
-        for dm in self.dataManagers:
-            if dm.isUp:
-                waitsForGraph = dm.generateWaitsForGraph()
-                for node, adjList in waitsForGraph.items():
-                    graph[node].update(adjList)
+        if self.prevention:
+            return self.abortVictims()
 
-        # print(dict(graph))
+        # Detect deadlocks using cycle detection and abort the youngest transaction in the cycle.
 
         newestTransId = None
         newestTransTs = -1
 
-        for node in list(graph.keys()):
-            visited = set()
-            if self.hasCycle(node, node, visited, graph):
-                if self.transactionQueue[node].timestamp > newestTransTs:
-                    newestTransId = node
-                    newestTransTs = self.transactionQueue[node].timestamp
+        for node in self.waitsForGraph.findCycleNodes(self.sitePool, self.transactionQueue):
+            # A transaction that ended while its lock request was pending can still appear in the graph,
+            # but it cannot be aborted
+            if node not in self.transactionQueue:
+                continue
+            if self.transactionQueue[node].timestamp > newestTransTs:
+                newestTransId = node
+                newestTransTs = self.transactionQueue[node].timestamp
 
         if newestTransId:
             # print("Deadlock detected: aborting {}".format(newestTransId))
+            if self.stats:
+                self.stats.count('deadlock cycles')
             self.abort(newestTransId)
             return True
 
         return False
 
-    def hasCycle(self, curr, root, visited, graph):
+    def abortVictims(self):
         '''
-        curr: node from which graph is traversed
-        root: node on which cycle is checked
-        visited: set of nodes that have been visited
-        graph: dictionary containing conflict edges
-
-        The method traverses the graph in DFS fashion and checks if there is a cycle in the graph
+        Aborts the transactions chosen by the deadlock prevention policy during the tick, youngest first
+        Returns true if a transaction was aborted
         '''
-        
-        visited.add(curr)
-        for adjNode in graph[curr]:
-            if adjNode == root:
-                return True
-            if adjNode not in visited:
-                if self.hasCycle(adjNode, root, visited, graph):
-                    return True
-        return False
\ No newline at end of file
+
+        victims = self.prevention.popVictims()
+        for trans_id in victims:
+            if trans_id in self.transactionQueue:
+                self.abort(trans_id, cause=self.prevention.policy)
+
+        return len(victims) > 0
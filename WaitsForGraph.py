@@ -0,0 +1,148 @@
+from collections import defaultdict
+from collections import Counter
+from operator import methodcaller
+
+class WaitsForGraph:
+    def __init__(self):
+        '''
+        edges: Dictionary containing waiting transaction as key and a Counter of blocking transactions as value.
+               The count is the number of lock managers that contribute the edge
+        lockEdges: Dictionary containing (site id, variable name) as key and set of edges contributed by that
+                   lock manager as value
+        changedLocks: Dictionary containing (site id, variable name) as key and the lock manager whose state changed
+                      since the graph was last updated as value
+        searchRoots: set of the transactions the next search starts from: the waiters of the edges added since the
+                     last search that found no cycle of running transactions, and the members of the cycles found
+                     since then. Removing edges cannot create a cycle and a new cycle goes through a new edge, so the
+                     graph is searched only when this is not empty and only from these transactions
+
+        The graph is shared by all the data managers and updated as locks are requested, granted and released
+        '''
+
+        self.edges = defaultdict(Counter)
+        self.lockEdges = {}
+        self.changedLocks = {}
+        self.searchRoots = set()
+
+    def __repr__(self):
+        return str({node: set(adj) for node, adj in self.edges.items()})
+
+    def markChanged(self, siteId, lockManager):
+        '''
+        siteId: site id of the data manager holding the lock manager
+        lockManager: lock manager whose current lock or pending requests changed
+        '''
+        self.changedLocks[(siteId, lockManager.var)] = lockManager
+
+    def update(self, sitePool=None):
+        '''
+        sitePool: SitePool computing the edges of the lock managers of every site in the worker of the site.
+                  The edges are computed one after another if None
+
+        Recomputes the edges of the lock managers that changed and applies the difference to the graph
+        '''
+
+        changedLocks = list(self.changedLocks.items())
+        if sitePool:
+            # The site locks compute their edges differently, so the method of every lock manager is called
+            changedEdges = sitePool.map(methodcaller('waitsForEdges'), [(key[0], lm) for key, lm in changedLocks])
+        else:
+            changedEdges = [lm.waitsForEdges() for key, lm in changedLocks]
+
+        for (key, lockManager), newEdges in zip(changedLocks, changedEdges):
+            oldEdges = self.lockEdges.get(key, set())
+
+            for waiter, holder in oldEdges - newEdges:
+                self.edges[waiter][holder] -= 1
+                if self.edges[waiter][holder] == 0:
+                    del self.edges[waiter][holder]
+                    if not self.edges[waiter]:
+                        del self.edges[waiter]
+
+            for waiter, holder in newEdges - oldEdges:
+                self.edges[waiter][holder] += 1
+                self.searchRoots.add(waiter)
+
+            if newEdges:
+                self.lockEdges[key] = newEdges
+            else:
+                self.lockEdges.pop(key, None)
+
+        self.changedLocks = {}
+
+    def findCycleNodes(self, sitePool=None, transactions=None):
+        '''
+        sitePool: SitePool passed on to update(), None if the sites are not run by workers
+        transactions: running transactions. A transaction that ended while its lock request was pending stays in
+                      the graph, so a cycle made only of ended transactions is not searched for again
+
+        Returns the list of transactions that are part of a cycle reachable from the search roots. Every cycle
+        with a running transaction is reachable from them.
+
+        The strongly connected components are found in a single pass using an iterative version of Tarjan's
+        algorithm. A transaction is in a cycle if its component has more than one transaction since a transaction
+        never waits for itself.
+        '''
+
+        self.update(sitePool)
+        if not self.searchRoots:
+            return []
+
+        index = {}
+        lowLink = {}
+        stack = []
+        onStack = set()
+        cycleNodes = []
+
+        for root in list(self.searchRoots):
+            if root in index:
+                continue
+
+            index[root] = lowLink[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            work = [(root, iter(self.edges.get(root, ())))]
+
+            while work:
+                node, adjIter = work[-1]
+                pushed = False
+                for adjNode in adjIter:
+                    if adjNode not in index:
+                        index[adjNode] = lowLink[adjNode] = len(index)
+                        stack.append(adjNode)
+                        onStack.add(adjNode)
+                        work.append((adjNode, iter(self.edges.get(adjNode, ()))))
+                        pushed = True
+                        break
+                    elif adjNode in onStack:
+                        lowLink[node] = min(lowLink[node], index[adjNode])
+
+                if pushed:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowLink[parent] = min(lowLink[parent], lowLink[node])
+
+                # node is the root of a strongly connected component, pop the component from the stack
+                if lowLink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        cycleNodes.extend(component)
+
+        # No cycle left that a running transaction is part of, so the graph does not have to be searched again
+        # until a new edge is added. Otherwise the cycles are searched from their members again, since the edges
+        # leading to them from the roots may be removed
+        if any(transactions is None or node in transactions for node in cycleNodes):
+            self.searchRoots.update(cycleNodes)
+        else:
+            self.searchRoots = set()
+
+        return cycleNodes
@@ -0,0 +1,105 @@
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+class WorkloadGenerator:
+    def __init__(self, numTransactions=100, opsPerTransaction=5, readRatio=0.5, skew='uniform', zipfExponent=1.0,
+                 readOnlyFraction=0.0, failureRate=0.0, concurrency=10, numVars=20, numSites=10, seed=None):
+        '''
+        numTransactions: number of transactions in the workload
+        opsPerTransaction: average number of reads and writes per transaction. The count of every transaction is
+                           drawn uniformly between 1 and 2*opsPerTransaction-1
+        readRatio: probability that an operation of a read-write transaction is a read
+        skew: distribution of the accessed variables. uniform or zipf
+        zipfExponent: exponent of the zipf distribution. x1 is the most accessed variable
+        readOnlyFraction: probability that a transaction is read-only
+        failureRate: probability that a site fails before a command. A failed site recovers with the same
+                     probability before every later command
+        concurrency: maximum number of transactions running at the same time
+        numVars: number of variables x1 to x<numVars>
+        numSites: number of sites that can fail
+        seed: seed of the random generator, used to generate the same workload again
+        '''
+
+        if skew not in ('uniform', 'zipf'):
+            raise ValueError('Unknown skew {}'.format(skew))
+
+        self.numTransactions = numTransactions
+        self.opsPerTransaction = opsPerTransaction
+        self.readRatio = readRatio
+        self.skew = skew
+        self.readOnlyFraction = readOnlyFraction
+        self.failureRate = failureRate
+        self.concurrency = max(1, concurrency)
+        self.numVars = numVars
+        self.numSites = numSites
+        self.random = random.Random(seed)
+
+        # cumulative weights of the zipf distribution over the variables
+        self.zipfWeights = None
+        if skew == 'zipf':
+            self.zipfWeights = list(accumulate(1.0 / (i ** zipfExponent) for i in range(1, numVars + 1)))
+
+    def pickVariable(self):
+        '''
+        Returns the name of a variable drawn from the configured distribution
+        '''
+        if self.zipfWeights:
+            i = bisect_left(self.zipfWeights, self.random.random() * self.zipfWeights[-1]) + 1
+        else:
+            i = self.random.randint(1, self.numVars)
+        return 'x' + str(i)
+
+    def generate(self):
+        '''
+        Yields the commands of the workload one by one. Every transaction that begins also ends,
+        and a dump() is issued at the end
+        '''
+
+        rand = self.random
+        active = []
+        remainingOps = {}
+        readOnly = set()
+        downSites = []
+        begun = 0
+
+        while begun < self.numTransactions or active:
+            # Fail or recover sites
+            if self.failureRate:
+                if downSites and rand.random() < self.failureRate:
+                    yield 'recover({})'.format(downSites.pop(rand.randrange(len(downSites))))
+                if len(downSites) < self.numSites and rand.random() < self.failureRate:
+                    site = rand.choice([s for s in range(1, self.numSites + 1) if s not in downSites])
+                    downSites.append(site)
+                    yield 'fail({})'.format(site)
+
+            # Start a new transaction when there is room for it, with a chance to keep working on the active ones
+            if begun < self.numTransactions and len(active) < self.concurrency and (not active or rand.random() < 0.5):
+                begun = begun + 1
+                trans_id = 'T' + str(begun)
+                active.append(trans_id)
+                remainingOps[trans_id] = rand.randint(1, max(1, 2 * self.opsPerTransaction - 1))
+                if rand.random() < self.readOnlyFraction:
+                    readOnly.add(trans_id)
+                    yield 'beginRO({})'.format(trans_id)
+                else:
+                    yield 'begin({})'.format(trans_id)
+                continue
+
+            index = rand.randrange(len(active))
+            trans_id = active[index]
+
+            if remainingOps[trans_id] == 0:
+                active[index] = active[-1]
+                active.pop()
+                del remainingOps[trans_id]
+                readOnly.discard(trans_id)
+                yield 'end({})'.format(trans_id)
+            elif trans_id in readOnly or rand.random() < self.readRatio:
+                remainingOps[trans_id] -= 1
+                yield 'R({},{})'.format(trans_id, self.pickVariable())
+            else:
+                remainingOps[trans_id] -= 1
+                yield 'W({},{},{})'.format(trans_id, self.pickVariable(), rand.randint(1, 10000))
+
+        yield 'dump()'
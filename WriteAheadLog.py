@@ -0,0 +1,198 @@
+import os
+import json
+from SiteImage import SiteImage
+from SiteImage import writeSiteImage
+
+class WriteAheadLog:
+    def __init__(self, directory, siteId, group):
+        '''
+        directory: directory holding the log and checkpoint files
+        siteId: id of the site whose changes are logged
+        group: LogGroup syncing the log once per tick
+        logPath: file to which the committed writes, failures and recoveries of the site are appended
+        checkpointPath: binary SiteImage holding the last checkpoint of the site. The log only holds the records
+                        written after it
+        logFile: log file opened for appending, opened on the first append
+        '''
+
+        self.siteId = siteId
+        self.group = group
+        self.logPath = os.path.join(directory, 'site{}.log'.format(siteId))
+        self.checkpointPath = os.path.join(directory, 'site{}.ckpt'.format(siteId))
+        self.logFile = None
+
+    def append(self, record):
+        '''
+        record: dictionary describing the change
+
+        Appends the record to the log. It is written to disk when the group syncs at the end of the tick
+        '''
+
+        if not self.logFile:
+            self.logFile = open(self.logPath, 'a')
+        self.logFile.write(json.dumps(record) + '\n')
+        self.group.logChanged(self)
+
+    def sync(self):
+        '''
+        Flushes the appended records and forces them to disk
+        '''
+
+        if self.logFile:
+            self.logFile.flush()
+            os.fsync(self.logFile.fileno())
+
+    def readCheckpoint(self):
+        '''
+        Returns the SiteImage of the last checkpoint, mapped in memory, or None if there is no checkpoint
+        '''
+
+        if not os.path.exists(self.checkpointPath):
+            return None
+        return SiteImage(self.checkpointPath)
+
+    def readLog(self):
+        '''
+        Yields the records of the log in the order they were appended.
+        Reading stops at a partially written last record, which was never synced
+        '''
+
+        if not os.path.exists(self.logPath):
+            return
+        with open(self.logPath, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                yield record
+
+    def writeCheckpoint(self, isUp, upSince, records):
+        '''
+        isUp: Indicates if the site is up
+        upSince: time since when the site is up
+        records: iterable of (variable index, value, lastWrite, isReadable) of every variable of the site
+
+        Writes the state to a new checkpoint file which replaces the old one, then empties the log
+        since all its records are part of the checkpoint
+        '''
+
+        self.sync()
+        tempPath = self.checkpointPath + '.tmp'
+        writeSiteImage(tempPath, isUp, upSince, records)
+        os.replace(tempPath, self.checkpointPath)
+
+        if self.logFile:
+            self.logFile.close()
+        self.logFile = open(self.logPath, 'w')
+        self.sync()
+
+    def close(self):
+        '''
+        Syncs and closes the log file
+        '''
+
+        if self.logFile:
+            self.sync()
+            self.logFile.close()
+            self.logFile = None
+
+class LogGroup:
+    def __init__(self, directory, checkpointInterval=1000):
+        '''
+        directory: directory holding the log and checkpoint files of all the sites
+        checkpointInterval: number of ticks between checkpoints
+        logs: Dictionary with site id as key and WriteAheadLog of the site as value
+        unsyncedLogs: set of logs with records appended in the current tick
+        uncheckpointedLogs: set of logs with records appended since the last checkpoint
+        ticks: number of ticks ended so far
+
+        Group commit: the logs changed during a tick are synced once at the end of the tick instead of on every write
+        Raises ValueError if checkpointInterval is below 1
+        '''
+
+        if checkpointInterval < 1:
+            raise ValueError('The checkpoint interval must be at least 1, got {}'.format(checkpointInterval))
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.checkpointInterval = checkpointInterval
+        self.logs = {}
+        self.unsyncedLogs = set()
+        self.uncheckpointedLogs = set()
+        self.ticks = 0
+
+    def getLog(self, siteId):
+        '''
+        siteId: site id
+
+        Returns the WriteAheadLog of the site
+        '''
+
+        if siteId not in self.logs:
+            self.logs[siteId] = WriteAheadLog(self.directory, siteId, self)
+        return self.logs[siteId]
+
+    def logChanged(self, log):
+        '''
+        log: WriteAheadLog to which a record was appended
+        '''
+        self.unsyncedLogs.add(log)
+        self.uncheckpointedLogs.add(log)
+
+    def endTick(self, dataManagers, sitePool=None):
+        '''
+        dataManagers: Array of the data managers, indexed by site id - 1
+        sitePool: SitePool syncing and checkpointing every site in the worker of the site. The sites are synced
+                  one after another if None
+
+        Syncs the logs changed during the tick and checkpoints the changed sites every checkpointInterval ticks
+        '''
+
+        if sitePool and len(self.unsyncedLogs) > 1:
+            sitePool.map(WriteAheadLog.sync, [(log.siteId, log) for log in self.unsyncedLogs])
+        else:
+            for log in self.unsyncedLogs:
+                log.sync()
+        self.unsyncedLogs.clear()
+
+        self.ticks = self.ticks + 1
+        if self.ticks % self.checkpointInterval == 0:
+            self.checkpoint(dataManagers, sitePool)
+
+    def checkpoint(self, dataManagers, sitePool=None):
+        '''
+        dataManagers: Array of the data managers, indexed by site id - 1
+        sitePool: SitePool checkpointing every site in the worker of the site, None to checkpoint them one after another
+
+        Checkpoints the sites that have log records since their last checkpoint
+        '''
+
+        changedSites = [dataManagers[log.siteId-1] for log in sorted(self.uncheckpointedLogs, key=lambda log: log.siteId)]
+        if sitePool:
+            sitePool.call(changedSites, 'checkpoint')
+        else:
+            for dm in changedSites:
+                dm.checkpoint()
+        self.uncheckpointedLogs.clear()
+
+    def checkpointAll(self, dataManagers, sitePool=None):
+        '''
+        dataManagers: Array of the data managers, indexed by site id - 1
+        sitePool: SitePool checkpointing every site in the worker of the site, None to checkpoint them one after another
+
+        Checkpoints every site, changed or not
+        '''
+
+        for dm in dataManagers:
+            self.uncheckpointedLogs.add(self.getLog(dm.siteId))
+        self.checkpoint(dataManagers, sitePool)
+
+    def close(self):
+        '''
+        Syncs and closes all the logs
+        '''
+
+        for log in self.logs.values():
+            log.close()
+        self.unsyncedLogs.clear()
@@ -0,0 +1,132 @@
+import sys
+import time
+import argparse
+from collections import Counter
+from TransactionManager import TransactionManager
+from WorkloadGenerator import WorkloadGenerator
+from EventSink import NullEventSink
+from Layout import Layout
+from Stats import Stats
+from DeadlockPrevention import POLICIES
+from ReplicaSelection import REPLICA_POLICIES
+
+# Phases of a tick timed by the TransactionManager stats
+PHASES = ['processInstruction', 'executeOperations', 'resolveDeadlock']
+
+
+class CountingEventSink(NullEventSink):
+    def __init__(self):
+        '''
+        counts: Counter of the emitted events by name. Aborts are counted by cause as well
+        '''
+        NullEventSink.__init__(self)
+        self.counts = Counter()
+
+    def emit(self, event, **fields):
+        self.counts[event] += 1
+        if event == 'abort':
+            self.counts['abort: ' + fields['cause']] += 1
+
+
+def run(commands, layout, workers=0, prevention=None, quorum=None, replicaPolicy='first', escalation=None):
+    '''
+    commands: list of commands to be processed
+    layout: Layout of the database
+    workers: number of worker threads running the sites, 0 to call them one after another
+    prevention: deadlock prevention policy, None to detect deadlocks
+    quorum: (read quorum, write quorum) sizes, None to write every up replica
+    replicaPolicy: replica selection policy of the reads
+    escalation: lock escalation threshold, None to only lock variables
+
+    Processes the commands in a new TransactionManager without output and returns (elapsed time, event counts,
+    stats)
+    '''
+
+    sink = CountingEventSink()
+    stats = Stats()
+    tm = TransactionManager(layout, sink, stats, workers=workers, prevention=prevention, quorum=quorum,
+                            replicaPolicy=replicaPolicy, escalation=escalation)
+
+    start = time.perf_counter()
+    tm.processLines(commands)
+    elapsed = time.perf_counter() - start
+    tm.close()
+
+    return elapsed, sink.counts, stats
+
+
+def report(name, numCommands, elapsed, counts, stats):
+    '''
+    Prints the throughput, abort rate, time per phase and counters of a run
+    '''
+
+    ended = counts['commit'] + counts['abort']
+    print(name)
+    print('  commands: {}  time: {:.3f}s  commands/sec: {:.0f}'.format(numCommands, elapsed, numCommands / elapsed if elapsed else 0))
+    print('  commits: {}  aborts: {}  commits/sec: {:.0f}  abort rate: {:.2%}'.format(
+        counts['commit'], counts['abort'], counts['commit'] / elapsed if elapsed else 0, counts['abort'] / ended if ended else 0))
+    for cause in sorted(key for key in counts.keys() if key.startswith('abort: ')):
+        print('    {}: {}'.format(cause, counts[cause]))
+    for phase in PHASES:
+        seconds = stats.phaseTimes[phase]
+        print('  {}: {:.3f}s ({:.1%})'.format(phase, seconds, seconds / elapsed if elapsed else 0))
+    for name, count in sorted(stats.counters.items()):
+        print('  {}: {}'.format(name, count))
+
+
+def parseArgs():
+    '''
+    Parses the command line arguments
+    '''
+
+    parser = argparse.ArgumentParser(description='Generate workloads and measure the throughput of the transaction manager')
+    parser.add_argument('files', nargs='*', help='command files to benchmark instead of a generated workload')
+    parser.add_argument('--transactions', type=int, default=1000, help='number of generated transactions')
+    parser.add_argument('--ops', type=int, default=5, help='average number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.5, help='probability that an operation is a read')
+    parser.add_argument('--skew', choices=['uniform', 'zipf'], default='uniform', help='distribution of the accessed variables')
+    parser.add_argument('--zipf-exponent', type=float, default=1.0, help='exponent of the zipf distribution')
+    parser.add_argument('--ro-fraction', type=float, default=0.0, help='fraction of read-only transactions')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability that a site fails before a command')
+    parser.add_argument('--concurrency', type=int, default=10, help='maximum number of concurrent transactions')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the workload generator')
+    parser.add_argument('--repeat', type=int, default=1, help='number of times every workload is run')
+    parser.add_argument('--write-workload', metavar='FILE', help='write the generated workload to FILE and exit')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables')
+    parser.add_argument('--placement', choices=['even', 'chained'], default='even', help='placement policy of the variables')
+    parser.add_argument('--replication-factor', type=int, default=None, help='number of sites holding a replicated variable')
+    parser.add_argument('--deadlock', choices=('detect',) + POLICIES, default='detect', help='deadlock handling')
+    parser.add_argument('--quorum', type=int, nargs=2, metavar=('R', 'W'), default=None, help='read and write quorum sizes')
+    parser.add_argument('--replica-policy', choices=list(REPLICA_POLICIES.keys()), default='first', help='replica selection policy of the reads')
+    parser.add_argument('--workers', type=int, default=0, help='number of worker threads running the sites')
+    parser.add_argument('--escalation', type=int, metavar='N', default=None, help='lock escalation threshold')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parseArgs()
+    layout = Layout(args.sites, args.variables, args.placement, args.replication_factor)
+
+    workloads = []
+    if args.files:
+        for fileName in args.files:
+            with open(fileName, 'r') as f:
+                workloads.append((fileName, f.readlines()))
+    else:
+        generator = WorkloadGenerator(args.transactions, args.ops, args.read_ratio, args.skew, args.zipf_exponent,
+                                      args.ro_fraction, args.failure_rate, args.concurrency, args.variables,
+                                      args.sites, args.seed)
+        commands = [command + '\n' for command in generator.generate()]
+        if args.write_workload:
+            with open(args.write_workload, 'w') as f:
+                f.writelines(commands)
+            sys.exit(0)
+        workloads.append(('generated workload (seed {})'.format(args.seed), commands))
+
+    for name, commands in workloads:
+        for i in range(args.repeat):
+            elapsed, counts, stats = run(commands, layout, args.workers, args.deadlock if args.deadlock != 'detect' else None,
+                                          args.quorum, args.replica_policy, args.escalation)
+            report(name if args.repeat == 1 else '{} run {}'.format(name, i + 1), len(commands), elapsed, counts, stats)
@@ -1,18 +1,195 @@
 import sys
+import argparse
+import asyncio
+import contextlib
 from TransactionManager import TransactionManager
+from Layout import Layout
+from EventSink import EventSink
+from EventSink import JsonEventSink
+from EventSink import NullEventSink
+from Stats import Stats
+from DeadlockPrevention import POLICIES
+from ReplicaSelection import REPLICA_POLICIES
+from WriteAheadLog import LogGroup
+from Server import CommandServer
+from Server import RoutingEventSink
+from Trace import TraceRecorder
+from Trace import getConfig
+from Trace import replayTrace
+
+# Size of the read and write buffers used in batch mode
+BATCH_BUFFER_SIZE = 1 << 20
+
+# Event sinks selectable with --output
+SINKS = {'text': EventSink, 'json': JsonEventSink, 'quiet': NullEventSink}
+
+
+def parseArgs():
+    '''
+    Parses the command line arguments. The layout arguments default to 10 sites and 20 variables
+    with even variables replicated at all sites
+    '''
+
+    parser = argparse.ArgumentParser(description='Replicated concurrency control and recovery')
+    parser.add_argument('fileName', nargs='?', default=None, help='file with the commands to be processed')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables')
+    parser.add_argument('--placement', choices=['even', 'chained'], default='even',
+                        help='even: only even variables are replicated, chained: all variables are replicated')
+    parser.add_argument('--replication-factor', type=int, default=None,
+                        help='number of sites holding a replicated variable (default: all sites)')
+    parser.add_argument('--batch', action='store_true',
+                        help='stream the file with large buffers and write the output in blocks')
+    parser.add_argument('--output', choices=sorted(SINKS.keys()), default='text',
+                        help='text: human readable lines, json: one JSON object per event, quiet: no output')
+    parser.add_argument('--stats', action='store_true',
+                        help='collect phase times and counters, shown by the stats command and at the end of the run')
+    parser.add_argument('--wal-dir', default=None,
+                        help='directory of the write-ahead logs and checkpoints. The sites are restored from it on start')
+    parser.add_argument('--checkpoint-interval', type=int, default=1000,
+                        help='number of commands between checkpoints of the sites written to --wal-dir')
+    parser.add_argument('--catch-up', action='store_true',
+                        help='a recovering site copies the values written while it was down from an up replica')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker threads running the sites concurrently (default: 0, the sites are called one after another)')
+    parser.add_argument('--deadlock', choices=('detect',) + POLICIES, default='detect',
+                        help='detect: abort the youngest transaction of a cycle in the waits-for graph, '
+                             'wait-die or wound-wait: prevent deadlocks using the start times of the transactions')
+    parser.add_argument('--quorum', type=int, nargs=2, metavar=('R', 'W'), default=None,
+                        help='replicate with read quorum R and write quorum W instead of writing every up replica')
+    parser.add_argument('--replica-policy', choices=list(REPLICA_POLICIES.keys()), default='first',
+                        help='order in which a read tries the up sites holding a replicated variable')
+    parser.add_argument('--serve', metavar='ADDRESS', default=None,
+                        help='serve clients on ADDRESS, host:port for a TCP socket or the path of a Unix socket')
+    parser.add_argument('--admin', metavar='ADDRESS', default=None,
+                        help='with --serve, also listen on ADDRESS for clients that can only run dump and stats')
+    parser.add_argument('--escalation', type=int, metavar='N', default=None,
+                        help='escalate the variable locks of a transaction at a site to a site lock once it holds N')
+    parser.add_argument('--dump-file', metavar='FILE', default=None,
+                        help='write the output of the dump commands to FILE instead of the standard output')
+    parser.add_argument('--record', metavar='TRACE', default=None,
+                        help='record the commands and the decisions of the engine to the binary file TRACE')
+    parser.add_argument('--replay', metavar='TRACE', default=None,
+                        help='replay TRACE without output with the recorded settings and report the first divergence')
+    return parser.parse_args()
+
+
+def runReplay(path, workers):
+    '''
+    path: trace file
+    workers: number of worker threads running the sites
+
+    Replays the trace and prints the replay time or the first tick whose decisions differ from the recording.
+    Returns the exit status, 1 if the replay diverged
+    '''
+
+    try:
+        count, elapsed, divergence = replayTrace(path, workers)
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+
+    if divergence is None:
+        print('replayed {} commands in {:.6f}s, no divergence'.format(count, elapsed))
+        return 0
+
+    tick, command, recorded, replayed = divergence
+    print('divergence at command {}: {}'.format(tick, command))
+    # Only the first record that differs is shown
+    for i in range(max(len(recorded), len(replayed))):
+        expected = recorded[i] if i < len(recorded) else None
+        actual = replayed[i] if i < len(replayed) else None
+        if expected != actual:
+            print('  recorded: {}'.format(expected))
+            print('  replayed: {}'.format(actual))
+            break
+    return 1
+
+
+def runBatch(tm, fileName, showHeader):
+    '''
+    tm: TransactionManager processing the commands
+    fileName: file with the commands
+    showHeader: Indicates if the name of the file is printed before the output
+
+    Streams the commands of the file through the transaction manager. The output is buffered and written to
+    the standard output in blocks of BATCH_BUFFER_SIZE instead of line by line
+    '''
+
+    with open(sys.stdout.fileno(), 'w', buffering=BATCH_BUFFER_SIZE, closefd=False) as out:
+        with contextlib.redirect_stdout(out):
+            try:
+                if showHeader:
+                    print('\nfile: \n',fileName)
+                with open(fileName, 'r', buffering=BATCH_BUFFER_SIZE) as f:
+                    tm.processLines(f)
+                if tm.stats:
+                    tm.showStats([])
+                if showHeader:
+                    print('\n')
+            except IOError:
+                print('Error while opening file {}'.format(fileName))
 
 
 if __name__ == "__main__":
 
-    fileName = sys.argv[1] if len(sys.argv)>=2 else None
-    tm = TransactionManager()
-    if fileName:
+    args = parseArgs()
+    fileName = args.fileName
+    if args.replay:
+        sys.exit(runReplay(args.replay, args.workers))
+    if args.record and args.wal_dir:
+        # A replay starts from the initial values, not from the restored state
+        print('--record cannot be used with --wal-dir')
+        sys.exit(1)
+    try:
+        layout = Layout(args.sites, args.variables, args.placement, args.replication_factor)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    # The file name and blank lines around the output are only printed with the human readable output
+    showHeader = args.output == 'text'
+    # When serving, the events are routed to the clients in the chosen format
+    sink = RoutingEventSink(SINKS[args.output]()) if args.serve else SINKS[args.output]()
+    dumpFile = open(args.dump_file, 'w', buffering=BATCH_BUFFER_SIZE) if args.dump_file else None
+    prevention = args.deadlock if args.deadlock != 'detect' else None
+    recorder = None
+    logGroup = None
+    try:
+        logGroup = LogGroup(args.wal_dir, args.checkpoint_interval) if args.wal_dir else None
+        if args.record:
+            recorder = TraceRecorder(args.record, getConfig(layout, args.catch_up, prevention, args.quorum,
+                                                            args.replica_policy, args.escalation, args.stats))
+        tm = TransactionManager(layout, sink, Stats() if args.stats else None, logGroup, args.catch_up, args.workers,
+                                prevention, args.quorum, args.replica_policy,
+                                SINKS[args.output](dumpFile) if dumpFile else None, recorder, args.escalation)
+    except (IOError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    if args.serve:
+        print('serving on {}'.format(args.serve), flush=True)
+        try:
+            asyncio.run(CommandServer(tm, sink).serve(args.serve, args.admin))
+        except KeyboardInterrupt:
+            pass
+        if tm.stats:
+            # No client is left to route the summary to, so it is written to the standard output
+            sink.formatter.emit('stats', **tm.stats.summary())
+    elif fileName and args.batch:
+        sys.stdout.flush()
+        runBatch(tm, fileName, showHeader)
+    elif fileName:
         try:
-            print('\nfile: \n',fileName)
+            if showHeader:
+                print('\nfile: \n',fileName)
             with open(fileName, 'r') as f:
                 for command in f:
                     tm.processLine(command)
-            print('\n')
+            if tm.stats:
+                tm.showStats([])
+            if showHeader:
+                print('\n')
         except IOError:
             print('Error while opening file {}'.format(fileName))
     else:
@@ -20,12 +197,22 @@ if __name__ == "__main__":
         print('reading input from command line')
         print('Enter exit to terminate')
         while True:
-            command = input()
+            try:
+                command = input()
+            except EOFError:
+                # The input ended without exit
+                break
             # print(command)
             if command.strip() == 'exit':
                 break
             tm.processLine(command)
+        if tm.stats:
+            tm.showStats([])
 
-
-            
-
+    tm.close()
+    if logGroup:
+        logGroup.close()
+    if dumpFile:
+        dumpFile.close()
+    if recorder:
+        recorder.close()